@@ -2,6 +2,18 @@ from typing import Self, Optional, Callable, Coroutine
 
 from flet import Row, Container, Text, Icon, icons, MainAxisAlignment
 
+from crumb.types import Page, Total
+
+
+def format_total(total: int) -> str:
+    """Количество записей для подписи под таблицей, оценка показывается приблизительно: ~1.2M"""
+    if not getattr(total, 'estimated', False):
+        return str(total)
+    for divider, suffix in ((1_000_000_000, 'B'), (1_000_000, 'M'), (1_000, 'K')):
+        if total >= divider:
+            return f'~{total / divider:.1f}{suffix}'
+    return f'~{total}'
+
 
 class Paginator(Row):
 
@@ -11,7 +23,9 @@ class Paginator(Row):
             per_page: int,
             per_page_variants: tuple[int, ...],
             count: int = 7,
+            keyset: bool = False,
     ):
+        """:param keyset: Вместо номеров страниц только "назад" и "вперед" по курсорам ReadRepository.get_page"""
         Row.__init__(self, alignment=MainAxisAlignment.END)
         assert per_page in per_page_variants, f'{per_page} not in {per_page_variants}'
         self.per_page = per_page
@@ -19,13 +33,18 @@ class Paginator(Row):
         self.count = count
         self.total = 1
         self.current = 1
+        self.keyset = keyset
+        self.cursor: Optional[str] = None
+        self.next_cursor: Optional[str] = None
+        self.prev_cursor: Optional[str] = None
         self._btn_prev = PageBtn(paginator=self).prev()
         self._btn_next = PageBtn(paginator=self).next()
         self.on_current_change = on_current_change
 
+        self._total_control = Text(color='grey')
         self._per_page_control = Row()
         self._pages_control = Row()
-        self.controls = [self._per_page_control, self._pages_control]
+        self.controls = [self._total_control, self._per_page_control, self._pages_control]
 
     @property
     def skip(self) -> int:
@@ -39,7 +58,24 @@ class Paginator(Row):
         self.current = num
         await self.on_current_change()
 
+    async def set_cursor(self, cursor: Optional[str]):
+        self.cursor = cursor
+        await self.on_current_change()
+
+    def set_items_total(self, total: Total | int):
+        self.total = total // self.per_page + 1
+        self._total_control.value = f'Всего: {format_total(total)}'
+
+    def set_page(self, page: Page):
+        self.next_cursor = page.next_cursor
+        self.prev_cursor = page.prev_cursor
+
     def build_pages(self):
+        if self.keyset:
+            self._btn_prev.disable() if self.prev_cursor is None else self._btn_prev.enable()
+            self._btn_next.disable() if self.next_cursor is None else self._btn_next.enable()
+            self._pages_control.controls = [self._btn_prev, self._btn_next]
+            return
         pages = []
         for num in self.calc():
             btn = PageBtn(paginator=self)
@@ -162,11 +198,17 @@ class PageBtn(Container):
         return self
 
     async def on_click_prev(self, e=None):
-        if self.paginator.current > 1:
+        if self.paginator.keyset:
+            if self.paginator.prev_cursor is not None:
+                await self.paginator.set_cursor(self.paginator.prev_cursor)
+        elif self.paginator.current > 1:
             await self.paginator.set_current(self.paginator.current - 1)
 
     async def on_click_next(self, e=None):
-        if self.paginator.current < self.paginator.total:
+        if self.paginator.keyset:
+            if self.paginator.next_cursor is not None:
+                await self.paginator.set_cursor(self.paginator.next_cursor)
+        elif self.paginator.current < self.paginator.total:
             await self.paginator.set_current(self.paginator.current + 1)
 
     async def on_click_num(self, e=None):
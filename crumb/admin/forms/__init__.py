@@ -5,5 +5,5 @@ from .widget_schema_creator import WidgetSchemaCreator
 from .forms import (
     Form,
     SimpleInputForm, ModelInputForm, DirectoryInputForm, DocumentInputForm,
-    BaseListForm, ListForm, ChoiceForm
+    BaseListForm, ListForm, ChoiceForm, RepostingForm
 )
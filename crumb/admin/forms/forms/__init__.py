@@ -3,3 +3,4 @@ from .base_list_form import BaseListForm
 from .list_form import ListForm
 from .choice_form import ChoiceForm
 from crumb.admin.forms.forms.input_form import SimpleInputForm, ModelInputForm, DirectoryInputForm, DocumentInputForm
+from .reposting_form import RepostingForm
@@ -1,9 +1,13 @@
-from typing import TYPE_CHECKING, Sequence
+import warnings
+from typing import TYPE_CHECKING, Sequence, Optional
 
 from flet import Row, TapEvent, Column
+from tortoise.queryset import AwaitableQuery
 
 from crumb.constants import EMPTY_TUPLE
 from crumb.orm import BaseModel
+from crumb.types import ProjectionRow
+from crumb.utils import get_settings
 from crumb.admin.components.table import Table, TableHeader, TableHeaderCell, TableBody, TableRow, TableCell, Paginator
 from . import Form
 from .. import Primitive, WidgetSchemaCreator
@@ -15,6 +19,8 @@ if TYPE_CHECKING:
 
 class BaseListForm(Form):
     body: Column
+    # Читать только поля колонок таблицы (ReadRepository.fetch), строки будут ProjectionRow, а не экземплярами
+    use_projection: bool = True
 
     def __init__(
             self,
@@ -24,8 +30,10 @@ class BaseListForm(Form):
             per_page_variants: tuple[int, ...] = (10, 25, 50, 100),
             select_related: tuple[str] = EMPTY_TUPLE,
             prefetch_related: tuple[str] = EMPTY_TUPLE,
-            sort: Sequence[str] = EMPTY_TUPLE
+            sort: Sequence[str] = EMPTY_TUPLE,
+            keyset: bool = False,
     ):
+        """:param keyset: Листать по курсорам (ReadRepository.get_page) без OFFSET и подсчета общего количества"""
         super().__init__(box=box)
         self.app = self.box.app
         self.resource = self.box.resource
@@ -48,6 +56,7 @@ class BaseListForm(Form):
             on_current_change=self.update_items,
             per_page=per_page,
             per_page_variants=per_page_variants,
+            keyset=keyset,
         )
         self.sort = [sort] if isinstance(sort, str) else (EMPTY_TUPLE if sort is None else sort)
 
@@ -61,23 +70,41 @@ class BaseListForm(Form):
         return Row([])
 
     async def update_items(self):
-        items, total = await self.resource.repository(
+        repository = self.resource.repository(
             select_related=self.select_related,
             prefetch_related=self.prefetch_related,
-        ).get_all(
-            skip=self.paginator.skip,
-            limit=self.paginator.limit,
-            sort=self.sort,
-            filters=[]
         )
-        self.paginator.total = total // self.paginator.per_page + 1
+        if self.paginator.keyset:
+            page = await repository.get_page(
+                cursor=self.paginator.cursor,
+                limit=self.paginator.limit,
+                sort=list(self.sort),
+                filters=[],
+                projection=self.get_projection(),
+            )
+            items = page.items
+            self.paginator.set_page(page)
+        else:
+            items, total = await repository.get_all(
+                skip=self.paginator.skip,
+                limit=self.paginator.limit,
+                sort=self.sort,
+                filters=[],
+                projection=self.get_projection(),
+            )
+            self.paginator.set_items_total(total)
         self.paginator.build_pages()
         self.table.remove_all_rows()
         for item in items:
             self.add_row(item)
         await self.update_async()
 
-    def add_row(self, instance: BaseModel):
+    def get_projection(self) -> Optional[list[str]]:
+        if not self.use_projection:
+            return None
+        return [schema.name for schema in self.widget_schemas]
+
+    def add_row(self, instance: BaseModel | ProjectionRow):
         self.table.add_row(ListRecordRow(
             instance=instance,
             cells=[
@@ -92,8 +119,16 @@ class BaseListForm(Form):
     async def on_double_click(self, e: TapEvent):
         pass
 
-    def initial_for(self, item: BaseModel, field_name: str):
-        return self.resource.repository.get_instance_value(item, field_name)
+    def initial_for(self, item: BaseModel | ProjectionRow, field_name: str):
+        value = self.resource.repository.get_instance_value(item, field_name)
+        if isinstance(value, AwaitableQuery) and getattr(get_settings(), 'DEBUG', False):
+            # связь не подгружена: строка показала бы запрос, а не запись, и каждая строка ходила бы в БД
+            warnings.warn(
+                f'{type(self.resource).__name__}: колонка {field_name} не подгружена для {type(item).__name__}, '
+                f'добавьте ее в list_select_related/choice_select_related',
+                stacklevel=2,
+            )
+        return value
 
     async def close(self):
         await self.box.close()
@@ -102,7 +137,7 @@ class BaseListForm(Form):
 class ListRecordRow(TableRow):
     def __init__(
             self,
-            instance: BaseModel,
+            instance: BaseModel | ProjectionRow,
             cells: list[TableCell] = None,
     ):
         super().__init__(cells=cells)
@@ -4,6 +4,7 @@ from flet import Row, IconButton, icons, TapEvent
 
 from crumb.constants import EMPTY_TUPLE
 from crumb.orm import BaseModel
+from crumb.types import ProjectionRow
 from crumb.admin.layout import PayloadInfo
 from .base_list_form import BaseListForm
 
@@ -23,7 +24,8 @@ class ChoiceForm(BaseListForm):
             per_page_variants: tuple[int, ...] = (10, 25, 50, 100),
             select_related: tuple[str] = EMPTY_TUPLE,
             prefetch_related: tuple[str] = EMPTY_TUPLE,
-            sort: str | Sequence[str] = EMPTY_TUPLE
+            sort: str | Sequence[str] = EMPTY_TUPLE,
+            keyset: bool = False,
     ):
         super().__init__(
             box=box,
@@ -33,6 +35,7 @@ class ChoiceForm(BaseListForm):
             select_related=select_related,
             prefetch_related=prefetch_related,
             sort=sort,
+            keyset=keyset,
         )
         self.make_choice = make_choice
 
@@ -54,7 +57,14 @@ class ChoiceForm(BaseListForm):
         async with self.app.error_tracker():
             active_row = self.table.active_row
             if active_row:
-                await self.make_choice(active_row.instance)
+                instance = active_row.instance
+                if isinstance(instance, ProjectionRow):
+                    # в таблице только колонки списка, а выбор получает полный экземпляр
+                    instance = await self.resource.repository(
+                        select_related=self.select_related,
+                        prefetch_related=self.prefetch_related,
+                    ).get_one(instance.pk)
+                await self.make_choice(instance)
                 await self.close()
 
     async def on_clean(self, e=None):
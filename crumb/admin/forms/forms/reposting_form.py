@@ -0,0 +1,130 @@
+from functools import partial
+from typing import TYPE_CHECKING
+
+from flet import Row, Column, Text, ElevatedButton, IconButton, icons, ScrollMode
+
+from crumb.enums import NotifyStatus, RepostingState
+from crumb.entities.documents.reposting import RepostingTask, reposting_queue
+from crumb.admin.forms.schema import FormSchema, InputGroup
+from crumb.admin.forms.widgets import DatetimeInput, IntInput, Checkbox
+from .input_form import SimpleInputForm
+
+if TYPE_CHECKING:
+    from crumb.admin.layout import BOX
+
+
+STATE_LABELS = {
+    RepostingState.QUEUED: 'В очереди',
+    RepostingState.RUNNING: 'Выполняется',
+    RepostingState.DONE: 'Готово',
+    RepostingState.CANCELLED: 'Отменено',
+    RepostingState.FAILED: 'Ошибка',
+}
+
+
+class RepostingForm(SimpleInputForm):
+    """
+    Запуск перепроведения в фоновой очереди reposting_queue и ее задачи: прогресс, ошибка,
+    отмена и продолжение с последнего перепроведенного документа
+    """
+
+    def __init__(self, box: "BOX"):
+        super().__init__(box=box)
+        self.app = self.box.app
+        self.resource = self.box.resource
+        self.tasks_control = Column(spacing=5)
+
+    def get_form_schema(self) -> FormSchema:
+        return FormSchema(
+            InputGroup(name='params', fields=[
+                DatetimeInput(name='start', label='Перепровести с', required=True),
+                IntInput(
+                    name='chunk_size', label='Документов в транзакции', min_value=1, default=100, required=True,
+                ),
+            ]),
+            InputGroup(name='registers', label='Регистры', direction='vertical', fields=[
+                Checkbox(name=f'register_{i}', label=self.resource.register_label(register), default=True)
+                for i, register in enumerate(self.resource.registers)
+            ]),
+        )
+
+    def build_body(self):
+        self.build_tasks()
+        return Column(
+            controls=[
+                *self.build_inputs(),
+                Row([ElevatedButton('Перепровести', on_click=self.on_click_submit)]),
+                Text('Задачи', size=16),
+                self.tasks_control,
+            ],
+            scroll=ScrollMode.AUTO,
+        )
+
+    def get_action_bar(self) -> Row:
+        return Row([IconButton(icons.REPLAY_OUTLINED, on_click=self.refresh, tooltip='Обновить')])
+
+    def build_tasks(self):
+        self.tasks_control.controls = [self.task_row(task) for task in reversed(reposting_queue.tasks)]
+        if not self.tasks_control.controls:
+            self.tasks_control.controls.append(Text('Нет задач', color='grey'))
+
+    def task_row(self, task: RepostingTask) -> Row:
+        registers = ', '.join(self.resource.register_label(register) for register in task.registers)
+        progress = f'{task.done}/{"?" if task.total is None else task.total}'
+        controls = [
+            Text(f'{task.start:%d.%m.%Y %H:%M:%S}', width=150),
+            Text(registers, width=250),
+            Text(STATE_LABELS[task.state], width=100),
+            Text(progress, width=100),
+        ]
+        if task.state in (RepostingState.QUEUED, RepostingState.RUNNING):
+            controls.append(ElevatedButton('Отменить', on_click=partial(self.cancel, task)))
+        elif task.state in (RepostingState.CANCELLED, RepostingState.FAILED):
+            controls.append(ElevatedButton('Продолжить', on_click=partial(self.resume, task)))
+        if task.error is not None:
+            controls.append(Text(str(task.error), color='error'))
+        return Row(controls)
+
+    async def refresh(self, e=None):
+        self.build_tasks()
+        await self.update_async()
+
+    async def on_progress(self, task: RepostingTask):
+        # форма могла быть закрыта, пока задача выполняется
+        if self.page is not None:
+            await self.refresh()
+
+    async def on_click_submit(self, e=None):
+        async with self.app.error_tracker():
+            await self.submit()
+
+    async def submit(self):
+        if not self.form_is_valid():
+            await self.update_async()
+            return
+        data = self.cleaned_data()
+        registers = [
+            register for i, register in enumerate(self.resource.registers)
+            if data[f'register_{i}']
+        ]
+        if not registers:
+            await self.app.notify('Выберите хотя бы один регистр', NotifyStatus.WARN)
+            return
+        reposting_queue.submit(RepostingTask(
+            registers,
+            data['start'],
+            chunk_size=data['chunk_size'],
+            on_progress=self.on_progress,
+        ))
+        await self.app.notify('Перепроведение добавлено в очередь', NotifyStatus.SUCCESS)
+        await self.refresh()
+
+    async def cancel(self, task: RepostingTask, e=None):
+        task.cancel()
+        await self.refresh()
+
+    async def resume(self, task: RepostingTask, e=None):
+        resumed = task.resumed()
+        resumed.on_progress = self.on_progress
+        reposting_queue.submit(resumed)
+        await self.refresh()
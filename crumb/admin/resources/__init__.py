@@ -1,3 +1,4 @@
 from .base import Resource, ValuesListResource
 from .directories import DirectoryResource
 from .documents import DocumentResource
+from .reposting import RepostingResource
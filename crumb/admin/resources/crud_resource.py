@@ -5,10 +5,11 @@ from flet import Control
 from crumb.types import PK
 from crumb.exceptions import ObjectErrors
 from crumb.constants import EMPTY_TUPLE
+from crumb.enums import FieldTypes
 from crumb.entities.directories import DirectoryRepository
 from crumb.entities.documents import DocumentRepository
 from .base import Resource
-from ..forms import ListForm, ChoiceForm, ModelInputForm, Primitive
+from ..forms import ListForm, ChoiceForm, ModelInputForm, Primitive, InputGroup
 
 if TYPE_CHECKING:
     from crumb.admin.layout import BOX
@@ -34,6 +35,10 @@ class CrudResource(Resource[REP]):
     edit_form_primitive: Primitive = None
 
     list_base_sort: tuple[str, ...] = EMPTY_TUPLE
+    # Листать списки по курсорам вместо номеров страниц, см. ReadRepository.get_page
+    list_keyset: bool = False
+    # Добавлять в select_related списков o2o/fk из колонок primitive, см. primitive_select_related
+    auto_select_related: bool = True
     common_select_related: tuple[str, ...] = EMPTY_TUPLE
     common_prefetch_related: tuple[str, ...] = EMPTY_TUPLE
     list_select_related: tuple[str, ...] = EMPTY_TUPLE
@@ -64,6 +69,34 @@ class CrudResource(Resource[REP]):
     async def get_choice_prefetch_related(self) -> tuple[str, ...]:
         return *self.common_prefetch_related, *self.choice_prefetch_related
 
+    def primitive_select_related(self, primitive: Primitive) -> tuple[str, ...]:
+        """
+        o2o/fk, которые показывают колонки primitive, чтобы строки списка не догружали их по одной.
+        Поля групп (InputGroup и dict с primitive/fields) обходятся рекурсивно
+        """
+        if not self.auto_select_related:
+            return EMPTY_TUPLE
+        related = []
+        for item in primitive:
+            if isinstance(item, InputGroup):
+                related.extend(self.primitive_select_related(item.fields))
+                continue
+            elif Primitive.is_group(item):
+                related.extend(self.primitive_select_related(item.get('primitive') or item.get('fields') or ()))
+                continue
+            elif Primitive.is_schema(item):
+                name = item.name
+            elif Primitive.is_field_with_extra(item):
+                name = item[0]
+            else:
+                continue
+            field_type = self.repository.get_field_type(name)
+            if field_type in (FieldTypes.FK, FieldTypes.O2O):
+                related.append(name)
+            elif field_type in (FieldTypes.FK_PK, FieldTypes.O2O_PK):
+                related.append(self.repository.get_field_instance(name).reference.model_field_name)
+        return tuple(related)
+
     async def get_create_form_primitive(self):
         return self.create_form_primitive or self.form_primitive
 
@@ -87,12 +120,15 @@ class CrudResource(Resource[REP]):
             box: "BOX",
             primitive: "Primitive" = None,
     ) -> ListForm:
+        primitive = primitive or await self.get_list_primitive()
+        select_related = *await self.get_list_select_related(), *self.primitive_select_related(primitive)
         view = self.list_form(
             box=box,
-            primitive=primitive or await self.get_list_primitive(),
-            select_related=await self.get_list_select_related(),
+            primitive=primitive,
+            select_related=tuple(dict.fromkeys(select_related)),
             prefetch_related=await self.get_list_prefetch_related(),
-            sort=await self.get_list_base_sort()
+            sort=await self.get_list_base_sort(),
+            keyset=self.list_keyset,
         )
         return self.with_tab_title(view, 'list')
 
@@ -102,13 +138,16 @@ class CrudResource(Resource[REP]):
             make_choice: Callable[[Optional["BaseModel"]], Coroutine[..., ..., None]],
             primitive: "Primitive" = None,
     ) -> ChoiceForm:
+        primitive = primitive or await self.get_choice_primitive()
+        select_related = *await self.get_choice_select_related(), *self.primitive_select_related(primitive)
         view = self.choice_form(
             box=box,
-            primitive=primitive or await self.get_choice_primitive(),
+            primitive=primitive,
             make_choice=make_choice,
-            select_related=await self.get_list_select_related(),
-            prefetch_related=await self.get_list_prefetch_related(),
-            sort=await self.get_list_base_sort()
+            select_related=tuple(dict.fromkeys(select_related)),
+            prefetch_related=await self.get_choice_prefetch_related(),
+            sort=await self.get_list_base_sort(),
+            keyset=self.list_keyset,
         )
         return self.with_tab_title(view, 'choice')
 
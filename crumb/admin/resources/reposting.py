@@ -0,0 +1,65 @@
+from typing import Type, TYPE_CHECKING
+
+from flet import icons
+
+from crumb.constants import EMPTY_TUPLE
+from crumb.translations.entity import EntityTranslation
+from .base import Resource
+from ..forms import RepostingForm
+
+if TYPE_CHECKING:
+    from crumb.admin.app import CRuMbAdmin
+    from crumb.admin.layout import BOX
+    from crumb.entities.registers import BaseRegisterRepository
+
+
+__all__ = ["RepostingResource"]
+
+
+class RepostingResource(Resource):
+    """
+    Перепроведение документов из админки через reposting_queue. Регистрируется как обычный ресурс,
+    в registers перечисляются регистры, которые можно выбрать для перепроведения:
+
+        @CRuMbAdmin.register(present_in=(ServiceGroup, ))
+        class AppRepostingResource(RepostingResource):
+            registers = (StockRepository, PriceRepository)
+
+    Очередь живет в процессе админки, задачи выполняются в нем же.
+    """
+    registers: tuple[Type["BaseRegisterRepository"], ...] = EMPTY_TUPLE
+    ICON = icons.HISTORY
+
+    def __init__(self, app: "CRuMbAdmin") -> None:
+        self.app = app
+        self.translation = self.app.translation.entities.get(self.entity()) or EntityTranslation(
+            name='Перепроведение',
+            name_plural='Перепроведение',
+            _list='',
+            _choice='',
+            _creation='',
+        )
+
+    @classmethod
+    def entity(cls) -> str:
+        return 'reposting'
+
+    @classmethod
+    def default_method(cls) -> str:
+        return 'queue'
+
+    def _methods(self):
+        return {'queue': self.get_queue_form}
+
+    def register_label(self, register: Type["BaseRegisterRepository"]) -> str:
+        translation = self.app.translation.entities.get(register.entity())
+        return translation.name_plural if translation else register.__name__
+
+    def get_queue_form(self, box: "BOX") -> RepostingForm:
+        return self.with_tab_title(RepostingForm(box=box), 'queue')
+
+    def _tab_title_queue(self) -> str:
+        return self.name_plural
+
+    def _compare_tab_queue(self, query1: dict[str, ...], query2: dict[str, ...]) -> bool:
+        return True
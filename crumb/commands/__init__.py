@@ -2,3 +2,6 @@ from .commands import Command, register_command
 from .createsuperuser import CreateSuperUser
 from .run_flet_app import RunFletApp
 from .db_commands import DbCommands
+from .benchmark_insert import BenchmarkInsert
+from .partitions import RegisterPartitions
+from .repost import Repost
@@ -0,0 +1,53 @@
+from time import perf_counter
+
+from tortoise.transactions import in_transaction
+
+from crumb.commands import Command, register_command
+from crumb.enums import BulkInsertMethod
+from crumb.orm.bulk import bulk_insert, supports_copy
+from crumb.utils import import_string
+
+
+class _Rollback(Exception):
+    pass
+
+
+@register_command
+class BenchmarkInsert(Command):
+    name = 'benchmark_insert'
+    help_text = 'Сравнивает вставку INSERT пачками и COPY на копиях существующих строк модели с автоинкрементным pk'
+    need_db_connection = True
+
+    def add_arguments(self):
+        self.parser.add_argument('-r', '--repository', required=True, help='Путь к классу репозитория')
+        self.parser.add_argument('-n', '--rows', type=int, default=10000, help='Сколько строк вставлять')
+        self.parser.add_argument('-b', '--batch-size', type=int, default=100, help='Размер пачки для INSERT')
+
+    async def handle(self, repository: str, rows: int, batch_size: int):
+        model = import_string(repository).model
+        opts = model._meta
+        if not opts.pk.generated:
+            print(f'У {model.__name__} pk не генерируется БД, копии строк будут конфликтовать')
+            return
+        samples = await model.all().limit(rows)
+        if not samples:
+            print(f'Таблица {opts.db_table} пуста, нечего копировать')
+            return
+        if not supports_copy(opts.db):
+            print('COPY поддерживается только asyncpg, вместо него будет INSERT')
+
+        field_names = [name for name in opts.fields_db_projection if name != opts.pk_attr]
+        for method in BulkInsertMethod:
+            instances = [
+                model(**{name: getattr(samples[i % len(samples)], name) for name in field_names})
+                for i in range(rows)
+            ]
+            try:
+                async with in_transaction():
+                    start = perf_counter()
+                    await bulk_insert(model, instances, method=method, batch_size=batch_size)
+                    elapsed = perf_counter() - start
+                    raise _Rollback
+            except _Rollback:
+                pass
+            print(f'{method.value}: {rows} строк за {elapsed:.3f} с ({rows / elapsed:.0f} строк/с)')
@@ -0,0 +1,33 @@
+from crumb.commands import Command, register_command
+from crumb.entities.registers.partitioning import is_partitioned, create_partitions, convert_to_partitioned
+from crumb.utils import import_string
+
+
+@register_command
+class RegisterPartitions(Command):
+    name = 'partitions'
+    help_text = 'Создает партиции таблиц движений регистров на будущие периоды'
+    need_db_connection = True
+
+    def add_arguments(self):
+        self.parser.add_argument('-r', '--repositories', nargs='+', required=True, help='Пути к классам регистров')
+        self.parser.add_argument('-a', '--ahead', type=int, default=3, help='На сколько периодов вперед')
+        self.parser.add_argument(
+            '--convert', action='store_true', help='Перевести обычные таблицы на партиционирование'
+        )
+
+    async def handle(self, repositories: list[str], ahead: int, convert: bool):
+        for path in repositories:
+            repository = import_string(path)
+            if repository.partition_period is None:
+                print(f'{path}: не задан partition_period')
+                continue
+            if not await is_partitioned(repository):
+                if not convert:
+                    print(f'{path}: таблица не партиционирована, используйте --convert')
+                    continue
+                await convert_to_partitioned(repository, ahead=ahead)
+                print(f'{path}: таблица переведена на партиционирование')
+                continue
+            created = await create_partitions(repository, ahead=ahead)
+            print(f'{path}: создано партиций {len(created)} {", ".join(created)}')
@@ -0,0 +1,43 @@
+from datetime import datetime
+
+from tortoise import timezone
+
+from crumb.commands import Command, register_command
+from crumb.entities.documents.reposting import RepostingTask
+from crumb.utils import import_string
+
+
+@register_command
+class Repost(Command):
+    name = 'repost'
+    help_text = 'Перепроводит по порядку dt документы с движениями в регистрах начиная с даты'
+    need_db_connection = True
+
+    def add_arguments(self):
+        self.parser.add_argument('-r', '--registers', nargs='+', required=True, help='Пути к классам регистров')
+        self.parser.add_argument('-s', '--start', required=True, help='Дата начала в ISO формате')
+        self.parser.add_argument('-c', '--chunk-size', type=int, default=100, help='Документов в одной транзакции')
+        self.parser.add_argument('--resume', default=None, help='Продолжить после документа, например INV-10')
+
+    async def handle(self, registers: list[str], start: str, chunk_size: int, resume: str):
+        start_dt = datetime.fromisoformat(start)
+        if timezone.is_naive(start_dt):
+            start_dt = timezone.make_aware(start_dt)
+
+        def on_progress(task: RepostingTask):
+            print(f'{task.done}/{task.total}, последний {task.position}')
+
+        task = RepostingTask(
+            [import_string(path) for path in registers],
+            start_dt,
+            chunk_size=chunk_size,
+            resume_after=resume,
+            on_progress=on_progress,
+        )
+        try:
+            await task.run()
+        except BaseException:
+            if task.position is not None:
+                print(f'Прервано, продолжить: --resume {task.position}')
+            raise
+        print(f'Перепроведено документов: {task.done}')
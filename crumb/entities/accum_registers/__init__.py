@@ -1,2 +1,2 @@
-from .model import AccumRegister, AccumRegisterResult
+from .model import AccumRegister, AccumRegisterResult, AccumRegisterPeriodTotal
 from .repository import AccumRegisterRepository
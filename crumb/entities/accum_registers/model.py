@@ -1,7 +1,10 @@
+from datetime import datetime
+
+from crumb.orm import BaseModel, fields as orm_fields
 from crumb.entities.registers import BaseRegister, BaseRegisterResult
 
 
-__all__ = ["AccumRegister", "AccumRegisterResult"]
+__all__ = ["AccumRegister", "AccumRegisterResult", "AccumRegisterPeriodTotal"]
 
 
 class AccumRegister(BaseRegister):
@@ -16,3 +19,13 @@ class AccumRegisterResult(BaseRegisterResult):
 
     class Meta:
         abstract = True
+
+
+class AccumRegisterPeriodTotal(BaseModel):
+    """Оборот регистра накопления по ключу измерений за период (день, месяц, год), начинающийся с period"""
+    id: int = orm_fields.BigIntField(pk=True, generated=False)
+    period: datetime = orm_fields.DatetimeField()
+    count: int | float
+
+    class Meta:
+        abstract = True
@@ -1,10 +1,18 @@
 from datetime import datetime
-from typing import TypeVar, Any
+from typing import TypeVar, Any, Optional, Callable
 
 from tortoise.functions import Sum
+from tortoise import timezone
+from tortoise.transactions import in_transaction
 
+from crumb.constants import EMPTY_TUPLE
+from crumb.enums import Period
 from crumb.entities.registers import BaseRegisterRepository
-from .model import AccumRegister, AccumRegisterResult
+from crumb.orm import BaseModel
+from crumb.orm.bulk import upsert
+from crumb.repository import ReadRepository
+from crumb.utils import hash_key
+from .model import AccumRegister, AccumRegisterResult, AccumRegisterPeriodTotal
 
 
 __all__ = ["AccumRegisterRepository"]
@@ -16,14 +24,222 @@ ARR = TypeVar('ARR', bound=AccumRegisterResult)
 
 class AccumRegisterRepository(BaseRegisterRepository[AR, ARR]):
     main_field: str = 'count'
+    result_default: int | float = 0
+    # Если задан, то по каждому ключу измерений хранятся обороты за период (period),
+    # и остатки на дату считаются по ним и движениям с начала последнего периода
+    period_totals: Optional[ReadRepository[AccumRegisterPeriodTotal]] = None
+    period: Period = Period.MONTH
 
     @classmethod
-    async def calc_results(cls, time_point: datetime = None) -> list[dict[str, Any]]:
+    async def calc_results(
+            cls,
+            time_point: datetime = None,
+            *,
+            first_dim_values: Optional[list] = None,
+    ) -> list[dict[str, Any]]:
+        if time_point and cls.period_totals and first_dim_values is None:
+            return await cls.calc_results_by_totals(time_point)
         query = cls.model.annotate(result=Sum(cls.main_field))
         if time_point:
-            query = query.filter(dt__le=time_point)
+            query = query.filter(dt__lte=time_point)
+        if first_dim_values is not None:
+            query = query.filter(**{f'{cls.group_by[0]}__in': first_dim_values})
         return await query.group_by(*cls.group_by).values(*cls.group_by, 'result')
 
     @classmethod
-    async def get_results(cls, item_pks: list):
-        raise NotImplementedError()
+    async def calc_totals_before(cls, period_start: datetime) -> dict[tuple, int | float]:
+        """Сумма оборотов за периоды, начавшиеся до period_start, по ключам измерений"""
+        rows = await cls.period_totals.model\
+            .filter(period__lt=period_start)\
+            .annotate(result=Sum(cls.main_field))\
+            .group_by(*cls.group_by)\
+            .values(*cls.group_by, 'result')
+        return {tuple(row[field_name] for field_name in cls.group_by): row['result'] for row in rows}
+
+    @classmethod
+    async def calc_results_by_totals(cls, time_point: datetime) -> list[dict[str, Any]]:
+        """Остатки на time_point: сумма оборотов за прошедшие периоды и движения текущего периода"""
+        period_start = cls.period.start(time_point)
+        totals = await cls.calc_totals_before(period_start)
+        movements = await cls.model\
+            .filter(dt__gte=period_start, dt__lte=time_point)\
+            .annotate(result=Sum(cls.main_field))\
+            .group_by(*cls.group_by)\
+            .values(*cls.group_by, 'result')
+        results: dict[tuple, dict[str, Any]] = {
+            key: {**dict(zip(cls.group_by, key)), 'result': value}
+            for key, value in totals.items()
+        }
+        for row in movements:
+            key = tuple(row[field_name] for field_name in cls.group_by)
+            if key in results:
+                results[key]['result'] += row['result']
+            else:
+                results[key] = row
+        return list(results.values())
+
+    @classmethod
+    async def calc_turnovers(cls, start: datetime, end: datetime) -> list[dict[str, Any]]:
+        """
+        Начальный остаток (opening), приход (incoming), расход (outgoing) и конечный остаток (closing)
+        по ключам измерений за интервал [start, end] одним сгруппированным запросом.
+        Если заданы period_totals, начальный остаток до начала периода start берется из них.
+        """
+        dt = cls.column('dt')
+        main = cls.column(cls.main_field)
+        columns = ', '.join(cls.column(field_name) for field_name in cls.group_by)
+        selected = ', '.join(f'{cls.column(field_name)} AS "{field_name}"' for field_name in cls.group_by)
+        values = [start, end]
+        where = f'{dt} <= $2'
+        totals = {}
+        if cls.period_totals:
+            period_start = cls.period.start(start)
+            totals = await cls.calc_totals_before(period_start)
+            values.append(period_start)
+            where += f' AND {dt} >= $3'
+        rows = await cls.opts().db.execute_query_dict(
+            f'SELECT {selected}, '
+            f'    SUM(CASE WHEN {dt} < $1 THEN {main} ELSE 0 END) AS "opening", '
+            f'    SUM(CASE WHEN {dt} >= $1 AND {main} > 0 THEN {main} ELSE 0 END) AS "incoming", '
+            f'    SUM(CASE WHEN {dt} >= $1 AND {main} < 0 THEN -{main} ELSE 0 END) AS "outgoing" '
+            f'FROM "{cls.opts().db_table}" '
+            f'WHERE {where} '
+            f'GROUP BY {columns}',
+            values
+        )
+        results: dict[tuple, dict[str, Any]] = {
+            key: {**dict(zip(cls.group_by, key)), 'opening': value, 'incoming': 0, 'outgoing': 0}
+            for key, value in totals.items()
+        }
+        for row in rows:
+            key = tuple(row[field_name] for field_name in cls.group_by)
+            if key in results:
+                row['opening'] += results[key]['opening']
+            results[key] = row
+        turnovers = []
+        for row in results.values():
+            if row['opening'] or row['incoming'] or row['outgoing']:
+                row['closing'] = row['opening'] + row['incoming'] - row['outgoing']
+                turnovers.append(row)
+        return turnovers
+
+    @classmethod
+    def calc_deltas(
+            cls,
+            registered: list[AR],
+            unregistered: list[AR],
+            with_period: bool = False,
+    ) -> dict[tuple, int | float]:
+        """
+        Изменения main_field по ключам измерений, ключи без изменений не возвращаются.
+        :param with_period: Добавить к ключу начало периода движения.
+        """
+        deltas: dict[tuple, int | float] = {}
+        for sign, movements in ((1, registered), (-1, unregistered)):
+            for movement in movements:
+                key = cls.key_of(movement)
+                if with_period:
+                    key = (*key, cls.period.start(movement.dt))
+                deltas[key] = deltas.get(key, 0) + sign * getattr(movement, cls.main_field)
+        return {key: delta for key, delta in deltas.items() if delta}
+
+    @classmethod
+    async def update_results(
+            cls,
+            registered: list[AR] = EMPTY_TUPLE,
+            unregistered: list[AR] = EMPTY_TUPLE,
+    ):
+        """Применяет к итогам только изменения по затронутым ключам, нулевые итоги удаляются"""
+        if cls.period_totals:
+            await cls.update_period_totals(registered, unregistered)
+
+        deltas = cls.calc_deltas(registered, unregistered)
+        if not deltas:
+            return
+
+        await cls.add_deltas(cls.results.model, [cls.make_result(key, delta) for key, delta in deltas.items()])
+        cls.results_written(deltas.keys())
+
+    @classmethod
+    async def add_deltas(cls, model: type[BaseModel], instances: list[BaseModel]):
+        """
+        Прибавляет main_field instances к строкам model с теми же id (итогам или оборотам за период)
+        одним INSERT ... ON CONFLICT DO UPDATE, ставшие нулевыми строки удаляются.
+        Сложение выполняет БД, поэтому параллельные проведения по одним и тем же, в том числе новым,
+        ключам не падают на первичном ключе и не теряют изменения друг друга, даже вне транзакции.
+        """
+        opts = model._meta
+        main = f'"{opts.fields_db_projection[cls.main_field]}"'
+        update = f'{main} = "{opts.db_table}".{main} + EXCLUDED.{main}'
+        if 'dt' in opts.fields_map:
+            update += ', "dt" = EXCLUDED."dt"'
+        await upsert(model, instances, update=update)
+        await opts.db.execute_query(
+            f'DELETE FROM "{opts.db_table}" WHERE "id" = ANY($1) AND {main} = 0',
+            [[instance.id for instance in instances]]
+        )
+
+    @classmethod
+    def period_total_id(cls, key: tuple, period_start: datetime) -> int:
+        return hash_key((*key, f'{period_start:%Y%m%d}'))
+
+    @classmethod
+    def make_period_total(cls, key: tuple, period_start: datetime, value: int | float) -> AccumRegisterPeriodTotal:
+        instance = cls.period_totals.model(period=period_start)
+        for field_name, field_value in zip(cls.group_by, key):
+            setattr(instance, field_name, field_value)
+        setattr(instance, cls.main_field, value)
+        instance.id = cls.period_total_id(key, period_start)
+        return instance
+
+    @classmethod
+    async def update_period_totals(cls, registered: list[AR], unregistered: list[AR]):
+        deltas = cls.calc_deltas(registered, unregistered, with_period=True)
+        if not deltas:
+            return
+        await cls.add_deltas(
+            cls.period_totals.model,
+            [cls.make_period_total(key[:-1], key[-1], delta) for key, delta in deltas.items()],
+        )
+
+    @classmethod
+    async def reset_period_totals(cls):
+        await cls.period_totals.model.all().delete()
+        columns = ', '.join(cls.column(field_name) for field_name in cls.group_by)
+        selected = ', '.join(f'{cls.column(field_name)} AS "{field_name}"' for field_name in cls.group_by)
+        rows = await cls.opts().db.execute_query_dict(
+            f'SELECT {selected}, '
+            f'    date_trunc($1, {cls.column("dt")} AT TIME ZONE $2) AS "period", '
+            f'    SUM({cls.column(cls.main_field)}) AS "result" '
+            f'FROM "{cls.opts().db_table}" '
+            f'GROUP BY {columns}, "period"',
+            [cls.period.value, timezone.get_timezone()]
+        )
+        instances = [
+            cls.make_period_total(
+                key=tuple(row[field_name] for field_name in cls.group_by),
+                period_start=timezone.make_aware(row['period']),
+                value=row['result'],
+            )
+            for row in rows
+            if row['result']
+        ]
+        await cls.period_totals.model.bulk_create(instances, batch_size=100)
+
+    @classmethod
+    async def reset_results(cls):
+        await super().reset_results()
+        if cls.period_totals:
+            await cls.reset_period_totals()
+
+    @classmethod
+    async def rebuild_results(
+            cls,
+            shards: int = 4,
+            on_progress: Optional[Callable[[int, int], Any]] = None,
+    ):
+        await super().rebuild_results(shards=shards, on_progress=on_progress)
+        if cls.period_totals:
+            async with in_transaction() as conn:
+                await conn.execute_script(cls.lock_movements_query())
+                await cls.reset_period_totals()
@@ -1,10 +1,15 @@
-from typing import TypeVar
+from typing import TypeVar, TYPE_CHECKING, Any, Type, Iterable, Optional
 
 from tortoise.transactions import in_transaction
 
+from crumb.constants import EMPTY_TUPLE
 from crumb.repository import Repository, ValuesListRepository
+from crumb.types import PK
 from .model import Document, DocumentListValue
 
+if TYPE_CHECKING:
+    from crumb.entities.registers import BaseRegisterRepository
+
 
 __all__ = ["DocumentRepository"]
 
@@ -18,6 +23,8 @@ class DocumentRepository(Repository[D]):
 
     hidden_fields = {'conducted'}
     calculated = {'unique_number': FieldTypes.STR}
+    # Регистры, в которые документ пишет движения. По ним отменяется проведение
+    registers: tuple[Type["BaseRegisterRepository"], ...] = EMPTY_TUPLE
 
     def can_edit(self):
         super().can_edit()
@@ -45,8 +52,113 @@ class DocumentRepository(Repository[D]):
             self.instance.conducted = False
             await self.instance.save(force_update=True, update_fields=('conducted', ))
 
+    async def conduct_many(self, item_pk_list: list[PK]) -> int:
+        """
+        Проводит документы пачкой: движения всех документов пишутся одним register_many на регистр,
+        conducted выставляется одним UPDATE. Уже проведенные документы пропускаются.
+        Если apply_side_effects переопределен, он вызывается для каждого документа, как в conduct
+        """
+        async with in_transaction():
+            documents = await self._lock_many(item_pk_list, conducted=False)
+            if not documents:
+                return 0
+            if self._side_effects_overridden('apply_side_effects'):
+                for document in documents:
+                    await self.__class__(by=self.by, instance=document).apply_side_effects()
+            else:
+                items: dict[Type["BaseRegisterRepository"], list[tuple[D, list[dict[str, Any]]]]] = {}
+                for document in documents:
+                    movements = await self.__class__(by=self.by, instance=document).group_movements()
+                    for register, records in movements.items():
+                        items.setdefault(register, []).append((document, records))
+                for register, register_items in items.items():
+                    await register.register_many(register_items)
+            await self.model.filter(pk__in=[document.pk for document in documents]).update(conducted=True)
+        return len(documents)
+
+    async def _lock_many(self, item_pk_list: list[PK], conducted: bool) -> list[D]:
+        """
+        Блокирует документы из item_pk_list с данным conducted и загружает их через get_queryset по порядку
+        проведения. FOR UPDATE берется отдельным запросом без select_related: Postgres не блокирует
+        строки с nullable стороны LEFT JOIN
+        """
+        pks = await self.model.filter(pk__in=item_pk_list, conducted=conducted)\
+            .order_by('id').select_for_update().values_list('id', flat=True)
+        if not pks:
+            return []
+        return await self._get_many_queryset(pks).order_by('dt', 'id')
+
+    async def unconduct_many(self, item_pk_list: list[PK]) -> int:
+        """Отменяет проведение пачкой: движения удаляются одним unregister_many на каждый регистр из registers"""
+        async with in_transaction():
+            documents = await self._lock_many(item_pk_list, conducted=True)
+            if not documents:
+                return 0
+            if self._side_effects_overridden('cancel_side_effects'):
+                for document in documents:
+                    await self.__class__(by=self.by, instance=document).cancel_side_effects()
+            else:
+                for register in self.registers:
+                    await register.unregister_many(documents)
+            await self.model.filter(pk__in=[document.pk for document in documents]).update(conducted=False)
+        return len(documents)
+
+    async def repost(self):
+        """
+        Перепроводит проведенный документ после изменения: в регистрах пишется только разница движений,
+        итоги пересчитываются только по изменившимся ключам. Непроведенный документ просто проводится
+        """
+        if not self.instance.conducted:
+            return await self.conduct()
+        async with in_transaction():
+            await self.repost_side_effects()
+
+    async def repost_side_effects(self, registers: Optional[Iterable[Type["BaseRegisterRepository"]]] = None):
+        """
+        Переписывает движения документа в registers (по умолчанию во всех self.registers).
+        Если apply_side_effects/cancel_side_effects переопределены, документ перепроводится целиком
+        """
+        if self._side_effects_overridden('apply_side_effects') or self._side_effects_overridden('cancel_side_effects'):
+            await self.cancel_side_effects()
+            await self.apply_side_effects()
+            return
+        movements: dict[Type["BaseRegisterRepository"], list[dict[str, Any]]] = {
+            register: [] for register in (self.registers if registers is None else registers)
+            if register in self.registers
+        }
+        for register, records in (await self.group_movements()).items():
+            if register in movements:
+                movements[register].extend(records)
+        for register, records in movements.items():
+            await register.replace_movements(self.instance, records)
+
+    def _side_effects_overridden(self, name: str) -> bool:
+        return getattr(self.__class__, name) is not getattr(DocumentRepository, name)
+
+    async def get_movements(self) -> list[tuple[Type["BaseRegisterRepository"], list[dict[str, Any]]]]:
+        """Движения документа self.instance: [(регистр, записи), ...]. Регистры должны быть в registers"""
+        return []
+
+    async def group_movements(self) -> dict[Type["BaseRegisterRepository"], list[dict[str, Any]]]:
+        """
+        Движения get_movements, объединенные по регистрам. Регистр не из registers - ошибка:
+        отмена проведения удаляет движения только из registers, и по нему остались бы движения
+        """
+        movements: dict[Type["BaseRegisterRepository"], list[dict[str, Any]]] = {}
+        for register, records in await self.get_movements():
+            if register not in self.registers:
+                raise ValueError(f'{self.__class__.__name__}: регистра {register.__name__} нет в registers')
+            movements.setdefault(register, []).extend(records)
+        return movements
+
     async def apply_side_effects(self):
-        pass
+        """
+        Пишет движения из get_movements, по одному register на регистр: записи одного регистра объединяются.
+        Регистры пишутся по очереди - все запросы идут через одно соединение транзакции проведения
+        """
+        for register, records in (await self.group_movements()).items():
+            await register.register(self.instance, records)
 
     async def cancel_side_effects(self):
-        pass
+        for register in self.registers:
+            await register.unregister(self.instance)
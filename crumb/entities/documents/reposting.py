@@ -0,0 +1,199 @@
+import asyncio
+from datetime import datetime
+from inspect import isawaitable
+from typing import TYPE_CHECKING, Callable, Optional, Type
+
+from tortoise import Tortoise
+from tortoise.transactions import in_transaction
+
+from crumb.enums import RepostingState
+from .model import Document
+
+if TYPE_CHECKING:
+    from crumb.entities.registers import BaseRegisterRepository
+    from .repository import DocumentRepository
+
+
+__all__ = ["RepostingTask", "RepostingQueue", "reposting_queue", "document_repositories"]
+
+
+def document_repositories() -> dict[str, Type["DocumentRepository"]]:
+    """Репозитории документов по PREFIX, т.е. по началу registrator в движениях"""
+    repositories = {}
+    for app in Tortoise.apps.values():
+        for model in app.values():
+            if issubclass(model, Document) and not model._meta.abstract:
+                repository = getattr(model, 'REPOSITORIES', {}).get('__default__')
+                if repository is not None:
+                    repositories[model.PREFIX] = repository
+    return repositories
+
+
+class RepostingTask:
+    """
+    Перепроведение документов, у которых есть движения в registers с dt >= start.
+    Движения документов переписываются (repost_side_effects) только в registers, по возрастанию dt
+    пачками по chunk_size, каждая пачка в своей транзакции. Документ с переопределенными
+    apply_side_effects/cancel_side_effects перепроводится по всем своим регистрам.
+    position - последний перепроведенный registrator, с него можно продолжить (resume_after) после отмены или ошибки
+    """
+
+    def __init__(
+            self,
+            registers: list[Type["BaseRegisterRepository"]],
+            start: datetime,
+            *,
+            chunk_size: int = 100,
+            resume_after: Optional[str] = None,
+            on_progress: Optional[Callable[["RepostingTask"], ...]] = None,
+    ):
+        self.registers = registers
+        self.start = start
+        self.chunk_size = chunk_size
+        self.position = resume_after
+        self.on_progress = on_progress
+        self.done = 0
+        self.total: Optional[int] = None
+        self.error: Optional[BaseException] = None
+        self.started = False
+        self.finished = False
+        self._cancelled = False
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def cancel(self):
+        """Останавливает перепроведение после текущей пачки"""
+        self._cancelled = True
+
+    @property
+    def state(self) -> RepostingState:
+        if self.error is not None:
+            return RepostingState.FAILED
+        if self.finished:
+            return RepostingState.CANCELLED if self._cancelled else RepostingState.DONE
+        return RepostingState.RUNNING if self.started else RepostingState.QUEUED
+
+    def resumed(self) -> "RepostingTask":
+        """Новая задача с теми же параметрами, которая продолжит перепроведение после position"""
+        return RepostingTask(
+            self.registers,
+            self.start,
+            chunk_size=self.chunk_size,
+            resume_after=self.position,
+            on_progress=self.on_progress,
+        )
+
+    async def find_registrators(self) -> list[tuple[datetime, str, int]]:
+        """(dt, PREFIX, id) документов с движениями в registers начиная со start, по порядку перепроведения"""
+        found: dict[str, datetime] = {}
+        for register in self.registers:
+            rows = await register.opts().db.execute_query_dict(
+                f'SELECT {register.column("registrator")} AS "registrator", MIN({register.column("dt")}) AS "dt" '
+                f'FROM "{register.opts().db_table}" WHERE {register.column("dt")} >= $1 '
+                f'GROUP BY {register.column("registrator")}',
+                [self.start],
+            )
+            for row in rows:
+                if row['registrator'] not in found or row['dt'] < found[row['registrator']]:
+                    found[row['registrator']] = row['dt']
+        registrators = []
+        for registrator, dt in found.items():
+            prefix, _, pk = registrator.rpartition('-')
+            registrators.append((dt, prefix, int(pk)))
+        registrators.sort()
+        return registrators
+
+    async def run(self):
+        self.started = True
+        try:
+            registrators = await self.find_registrators()
+            if self.position is not None:
+                numbers = [f'{prefix}-{pk}' for _, prefix, pk in registrators]
+                if self.position not in numbers:
+                    raise ValueError(f'Документ {self.position} не найден среди перепроводимых')
+                registrators = registrators[numbers.index(self.position) + 1:]
+            self.total = len(registrators)
+            repositories = document_repositories()
+            for i in range(0, len(registrators), self.chunk_size):
+                if self._cancelled:
+                    return
+                await self.repost_chunk(registrators[i:i + self.chunk_size], repositories)
+                if self.on_progress is not None:
+                    result = self.on_progress(self)
+                    if isawaitable(result):
+                        await result
+        except BaseException as e:
+            self.error = e
+            raise
+        finally:
+            self.finished = True
+
+    async def repost_chunk(
+            self,
+            registrators: list[tuple[datetime, str, int]],
+            repositories: dict[str, Type["DocumentRepository"]],
+    ):
+        async with in_transaction():
+            instances: dict[tuple[str, int], Document] = {}
+            for prefix in {prefix for _, prefix, _ in registrators}:
+                if prefix not in repositories:
+                    raise ValueError(f'Нет репозитория документов с PREFIX {prefix}')
+                pks = [pk for _, p, pk in registrators if p == prefix]
+                query = repositories[prefix].model.filter(pk__in=pks, conducted=True).select_for_update()
+                for instance in await query:
+                    instances[(prefix, instance.pk)] = instance
+            for _, prefix, pk in registrators:
+                # Документ мог быть удален или распроведен, тогда его движения уже удалены
+                instance = instances.get((prefix, pk))
+                if instance is not None:
+                    await repositories[prefix](instance=instance).repost_side_effects(self.registers)
+        self.done += len(registrators)
+        _, prefix, pk = registrators[-1]
+        self.position = f'{prefix}-{pk}'
+
+
+class RepostingQueue:
+    """
+    Очередь перепроведений в текущем процессе. Задачи выполняются по одной в фоновом asyncio.Task.
+    В tasks остаются и keep_finished последних завершенных задач, чтобы был виден их результат или ошибка
+    """
+
+    def __init__(self, keep_finished: int = 20):
+        self.keep_finished = keep_finished
+        self.tasks: list[RepostingTask] = []
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    def submit(self, task: RepostingTask) -> RepostingTask:
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._work())
+        self.tasks.append(task)
+        self._queue.put_nowait(task)
+        return task
+
+    async def _work(self):
+        while True:
+            task = await self._queue.get()
+            try:
+                if task.cancelled:
+                    task.finished = True
+                else:
+                    await task.run()
+            except Exception:
+                # Ошибка остается в task.error, очередь продолжает работу
+                pass
+            finally:
+                finished = [old for old in self.tasks if old.finished]
+                for old in finished[:max(len(finished) - self.keep_finished, 0)]:
+                    self.tasks.remove(old)
+                self._queue.task_done()
+
+    async def join(self):
+        if self._queue is not None:
+            await self._queue.join()
+
+
+reposting_queue = RepostingQueue()
@@ -1,8 +1,10 @@
 from datetime import datetime
-from typing import TypeVar, Any
+from typing import TypeVar, Any, Iterable, Optional
 
+from tortoise import timezone
 from tortoise.transactions import in_transaction
 
+from crumb.constants import EMPTY_TUPLE, UndefinedValue
 from crumb.entities.registers import BaseRegisterRepository
 from .model import InfoRegister, InfoRegisterResult
 
@@ -17,23 +19,136 @@ IRR = TypeVar('IRR', bound=InfoRegisterResult)
 class InfoRegisterRepository(BaseRegisterRepository[IR, IRR]):
 
     @classmethod
-    async def calc_results(cls, time_point: datetime = None) -> list[dict[str, Any]]:
-        partition_by = ', '.join(f'"{f}"' for f in cls.group_by)
-        async with in_transaction() as conn:
-            _, rows = await conn.execute_query(
-                f'SELECT * '
-                f'FROM ('
-                f'    SELECT '
-                f'        {partition_by}, '
-                f'        "{cls.main_field}" as "result", '
-                f'        ROW_NUMBER() OVER (PARTITION BY {partition_by} ORDER BY "dt" DESC) as "rn" '
-                f'    FROM {cls.opts().db_table} '
-                f') sub '
-                f'WHERE rn=1 {"AND dt <= ?" if time_point else ""}',
-                values=[time_point] if time_point else None
+    async def calc_results(
+            cls,
+            time_point: datetime = None,
+            *,
+            first_dim_values: Optional[list] = None,
+    ) -> list[dict[str, Any]]:
+        """
+        Последние значения по каждому ключу измерений (на time_point, если передан).
+        Ограничение по дате применяется до выбора последней записи, поэтому с индексом
+        по (group_by..., dt) читается только нужная часть истории.
+        """
+        columns = ', '.join(cls.column(field_name) for field_name in cls.group_by)
+        selected = ', '.join(f'{cls.column(field_name)} AS "{field_name}"' for field_name in cls.group_by)
+        conditions = []
+        values = []
+        if time_point:
+            values.append(time_point)
+            conditions.append(f'{cls.column("dt")} <= ${len(values)}')
+        if first_dim_values is not None:
+            values.append(first_dim_values)
+            conditions.append(f'{cls.column(cls.group_by[0])} = ANY(${len(values)})')
+        where = f'WHERE {" AND ".join(conditions)} ' if conditions else ''
+        return await cls.opts().db.execute_query_dict(
+            f'SELECT DISTINCT ON ({columns}) {selected}, {cls.column(cls.main_field)} AS "result" '
+            f'FROM "{cls.opts().db_table}" '
+            f'{where}'
+            f'ORDER BY {columns}, {cls.column("dt")} DESC, {cls.column("id")} DESC',
+            values
+        )
+
+    @classmethod
+    async def calc_slices(
+            cls,
+            time_points: list[datetime],
+            keys: list[tuple],
+    ) -> dict[tuple[tuple, datetime], Any]:
+        """
+        Значения, действовавшие на каждую из дат по каждому ключу измерений, одним запросом на keys_batch_size ключей.
+        Для каждой пары (ключ, дата) LATERAL-подзапрос берет одну последнюю запись с dt <= даты,
+        поэтому с индексом по (group_by..., dt) история целиком не читается.
+        Пары, для которых записей на дату нет, в результат не попадают.
+        Результат по переданным объектам ключей и дат: наивные даты в запросе считаются в часовом поясе
+        tortoise (timezone.make_aware), но в ключах результата остаются как были переданы.
+        """
+        opts = cls.opts()
+        dims = ', '.join(f'"{field_name}"' for field_name in cls.group_by)
+        arrays = ', '.join(
+            f'${i}::{opts.fields_map[field_name].get_for_dialect("postgres", "SQL_TYPE")}[]'
+            for i, field_name in enumerate(cls.group_by, start=1)
+        )
+        time_points_param = len(cls.group_by) + 1
+        join_condition = ' AND '.join(
+            f'r.{cls.column(field_name)} = k."{field_name}"' for field_name in cls.group_by
+        )
+        query = (
+            f'SELECT k."key_index", tp."time_point_index", s."result" '
+            f'FROM unnest({arrays}) WITH ORDINALITY AS k({dims}, "key_index") '
+            f'CROSS JOIN unnest(${time_points_param}::timestamptz[]) '
+            f'    WITH ORDINALITY AS tp("time_point", "time_point_index") '
+            f'CROSS JOIN LATERAL ('
+            f'    SELECT r.{cls.column(cls.main_field)} AS "result" '
+            f'    FROM "{opts.db_table}" r '
+            f'    WHERE {join_condition} AND r.{cls.column("dt")} <= tp."time_point" '
+            f'    ORDER BY r.{cls.column("dt")} DESC, r.{cls.column("id")} DESC '
+            f'    LIMIT 1'
+            f') s'
+        )
+        result = {}
+        time_points = list(time_points)
+        aware_time_points = [
+            timezone.make_aware(time_point) if timezone.is_naive(time_point) else time_point
+            for time_point in time_points
+        ]
+        keys = list(keys)
+        for i in range(0, len(keys), cls.keys_batch_size):
+            batch = keys[i:i + cls.keys_batch_size]
+            rows = await opts.db.execute_query_dict(
+                query,
+                [*([key[j] for key in batch] for j in range(len(cls.group_by))), aware_time_points]
+            )
+            # ORDINALITY считается с 1
+            for row in rows:
+                result[(batch[row['key_index'] - 1], time_points[row['time_point_index'] - 1])] = row['result']
+        return result
+
+    @classmethod
+    def movement_fields(cls) -> tuple[str, ...]:
+        return cls.group_by
+
+    @classmethod
+    async def calc_last_values(cls, keys: Iterable[tuple]) -> dict[tuple, Any]:
+        """Последние значения только по переданным ключам измерений"""
+        keys = list(keys)
+        columns = ', '.join(cls.column(field_name) for field_name in cls.group_by)
+        selected = ', '.join(f'{cls.column(field_name)} AS "{field_name}"' for field_name in cls.group_by)
+        result = {}
+        for i in range(0, len(keys), cls.keys_batch_size):
+            condition, values = cls.keys_condition(keys[i:i + cls.keys_batch_size])
+            rows = await cls.opts().db.execute_query_dict(
+                f'SELECT DISTINCT ON ({columns}) {selected}, {cls.column(cls.main_field)} AS "result" '
+                f'FROM "{cls.opts().db_table}" '
+                f'WHERE {condition} '
+                f'ORDER BY {columns}, {cls.column("dt")} DESC, {cls.column("id")} DESC',
+                values
             )
-        return rows
+            for row in rows:
+                result[tuple(row[field_name] for field_name in cls.group_by)] = row['result']
+        return result
 
     @classmethod
-    async def get_results(cls, item_pks: list):
-        raise NotImplementedError()
+    async def update_results(
+            cls,
+            registered: list[IR] = EMPTY_TUPLE,
+            unregistered: list[IR] = EMPTY_TUPLE,
+    ):
+        """
+        Пересчитывает последние значения только по затронутым ключам.
+        Если после отмены записей по ключу ничего не осталось, итог удаляется.
+        Ключи до конца транзакции блокируются advisory-блокировками по id итога (и для еще не записанных итогов),
+        поэтому параллельное проведение по тем же ключам читает последние значения уже после фиксации этого
+        и не перезаписывает итог устаревшим значением.
+        """
+        keys = {cls.key_of(movement) for movement in (*registered, *unregistered)}
+        if not keys:
+            return
+        async with in_transaction() as conn:
+            # по возрастанию id, чтобы проведения с пересекающимися ключами не блокировали друг друга взаимно
+            await conn.execute_query(
+                'SELECT pg_advisory_xact_lock("id") FROM unnest($1::bigint[]) AS t("id")',
+                [sorted({cls.result_id(key) for key in keys})],
+            )
+            last_values = await cls.calc_last_values(keys)
+            await cls.write_results({key: last_values.get(key, UndefinedValue) for key in keys})
@@ -1,2 +1,2 @@
 from .model import BaseRegister, BaseRegisterResult
-from .repository import BaseRegisterRepository
+from .repository import BaseRegisterRepository, check_register_backends
@@ -9,7 +9,7 @@ __all__ = ["BaseRegister", "BaseRegisterResult"]
 
 class BaseRegister(BaseModel):
     id: int = orm_fields.BigIntField(pk=True)
-    registrator: str = orm_fields.CharField(max_length=REGISTRATOR_UNIQUE_NUMBER_MAX_LEN)
+    registrator: str = orm_fields.CharField(max_length=REGISTRATOR_UNIQUE_NUMBER_MAX_LEN, index=True)
     dt: datetime = orm_fields.DatetimeField()
 
     class Meta:
@@ -17,7 +17,8 @@ class BaseRegister(BaseModel):
 
 
 class BaseRegisterResult(BaseModel):
-    id: str = orm_fields.CharField(pk=True, max_length=25, generated=False)
+    """id - хэш значений измерений, см. BaseRegisterRepository.result_id"""
+    id: int = orm_fields.BigIntField(pk=True, generated=False)
     dt: datetime = orm_fields.DatetimeField(auto_now=True)
 
     class Meta:
@@ -0,0 +1,145 @@
+from datetime import datetime
+from typing import Type, TYPE_CHECKING, Optional
+
+from tortoise import timezone
+from tortoise.transactions import in_transaction
+
+if TYPE_CHECKING:
+    from .repository import BaseRegisterRepository
+
+
+__all__ = ["is_partitioned", "create_partitions", "convert_to_partitioned"]
+
+# Партиционирование таблиц движений регистров по dt (BaseRegisterRepository.partition_period).
+# Tortoise и aerich создают обычные таблицы, поэтому существующая таблица переводится на партиционирование
+# convert_to_partitioned, а партиции на будущие периоды создаются заранее create_partitions
+# (команда `partitions`, например, по расписанию или после `db --upgrade`).
+
+PARTITION_SUFFIX_FORMATS = {
+    'day': '%Y%m%d',
+    'month': '%Y%m',
+    'year': '%Y',
+}
+
+
+def partition_name(repository: Type["BaseRegisterRepository"], start: datetime) -> str:
+    suffix = start.strftime(PARTITION_SUFFIX_FORMATS[repository.partition_period.value])
+    return f'{repository.opts().db_table}_{suffix}'
+
+
+async def is_partitioned(repository: Type["BaseRegisterRepository"]) -> bool:
+    rows = await repository.opts().db.execute_query_dict(
+        'SELECT relkind FROM pg_class WHERE oid = to_regclass($1)',
+        [f'"{repository.opts().db_table}"']
+    )
+    return bool(rows) and rows[0]['relkind'] == 'p'
+
+
+async def create_partitions(
+        repository: Type["BaseRegisterRepository"],
+        ahead: int = 3,
+        since: datetime = None,
+) -> list[str]:
+    """
+    Создает недостающие партиции с периода since (по умолчанию - текущего) и еще на ahead периодов вперед.
+    Строки этих периодов, попавшие в партицию по умолчанию (например, движения документов будущими датами),
+    в той же транзакции переносятся в новую партицию, иначе postgres не дал бы ее создать.
+    Возвращает имена созданных партиций.
+    """
+    period = repository.partition_period
+    table = repository.opts().db_table
+    db = repository.opts().db
+    rows = await db.execute_query_dict(
+        'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+        'WHERE i.inhparent = to_regclass($1)',
+        [f'"{table}"']
+    )
+    existing = {row['relname'] for row in rows}
+    default = await default_partition(repository)
+    dt = repository.column('dt')
+
+    start = period.start(since or timezone.now())
+    last = timezone.now()
+    for _ in range(ahead):
+        last = period.next_start(last)
+    created = []
+    while start <= last:
+        end = period.next_start(start)
+        name = partition_name(repository, start)
+        if name not in existing:
+            bounds = f'{dt} >= \'{start.isoformat()}\' AND {dt} < \'{end.isoformat()}\''
+            async with in_transaction() as conn:
+                if default:
+                    await conn.execute_script(
+                        f'CREATE TEMPORARY TABLE "{name}__moved" (LIKE "{table}"); '
+                        f'WITH moved AS (DELETE FROM "{default}" WHERE {bounds} RETURNING *) '
+                        f'INSERT INTO "{name}__moved" SELECT * FROM moved;'
+                    )
+                await conn.execute_script(
+                    f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{table}" '
+                    f'FOR VALUES FROM (\'{start.isoformat()}\') TO (\'{end.isoformat()}\');'
+                )
+                if default:
+                    await conn.execute_script(
+                        f'INSERT INTO "{table}" SELECT * FROM "{name}__moved"; '
+                        f'DROP TABLE "{name}__moved";'
+                    )
+            created.append(name)
+        start = end
+    return created
+
+
+async def default_partition(repository: Type["BaseRegisterRepository"]) -> Optional[str]:
+    rows = await repository.opts().db.execute_query_dict(
+        'SELECT c.relname FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partdefid '
+        'WHERE p.partrelid = to_regclass($1)',
+        [f'"{repository.opts().db_table}"']
+    )
+    return rows[0]['relname'] if rows else None
+
+
+async def convert_to_partitioned(repository: Type["BaseRegisterRepository"], ahead: int = 3) -> None:
+    """
+    Переводит обычную таблицу движений на партиционирование по dt в одной транзакции:
+    создает партиционированную таблицу той же структуры (pk становится (id, dt), как того требует postgres),
+    партиции на весь диапазон данных и ahead периодов вперед, партицию по умолчанию, переносит строки,
+    индексы по registrator и (group_by..., dt) и внешние ключи. Таблица на время переноса блокируется.
+    """
+    opts = repository.opts()
+    table = opts.db_table
+    old_table = f'{table}__plain'
+    dt = repository.column('dt')
+    pk = repository.column(opts.pk_attr)
+    async with in_transaction() as conn:
+        foreign_keys = await conn.execute_query_dict(
+            'SELECT conname, pg_get_constraintdef(oid) AS definition FROM pg_constraint '
+            'WHERE conrelid = to_regclass($1) AND contype = \'f\'',
+            [f'"{table}"']
+        )
+        sequence = (await conn.execute_query_dict(
+            'SELECT pg_get_serial_sequence($1, $2) AS name',
+            [f'"{table}"', opts.fields_db_projection[opts.pk_attr]]
+        ))[0]['name']
+        bounds = (await conn.execute_query_dict(f'SELECT MIN({dt}) AS first FROM "{table}"'))[0]
+
+        dims = ', '.join(repository.column(field_name) for field_name in repository.group_by)
+        await conn.execute_script(
+            f'ALTER TABLE "{table}" RENAME TO "{old_table}"; '
+            f'CREATE TABLE "{table}" (LIKE "{old_table}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+            f'PARTITION BY RANGE ({dt}); '
+            f'ALTER TABLE "{table}" ADD PRIMARY KEY ({pk}, {dt}); '
+            f'CREATE INDEX ON "{table}" ({repository.column("registrator")}); '
+            f'CREATE INDEX ON "{table}" ({dims}, {dt}); '
+            f'CREATE TABLE "{table}_default" PARTITION OF "{table}" DEFAULT;'
+        )
+        if sequence:
+            await conn.execute_script(f'ALTER SEQUENCE {sequence} OWNED BY "{table}".{pk};')
+        await create_partitions(repository, ahead=ahead, since=bounds['first'])
+        await conn.execute_script(
+            f'INSERT INTO "{table}" SELECT * FROM "{old_table}"; '
+            f'DROP TABLE "{old_table}";'
+        )
+        for foreign_key in foreign_keys:
+            await conn.execute_script(
+                f'ALTER TABLE "{table}" ADD CONSTRAINT "{foreign_key["conname"]}" {foreign_key["definition"]};'
+            )
@@ -1,9 +1,22 @@
+import asyncio
+from collections import namedtuple
 from datetime import datetime
-from typing import Generic, TypeVar, TYPE_CHECKING, Any
+from inspect import isawaitable
+from time import monotonic
+from typing import Generic, TypeVar, TYPE_CHECKING, Any, Iterable, Optional, Callable
+from uuid import uuid4
 
+from tortoise import Tortoise
+from tortoise.exceptions import ConfigurationError
+from tortoise.transactions import in_transaction
+
+from crumb.enums import BulkInsertMethod, Period
+from crumb.orm.bulk import bulk_insert, copy_insert, supports_copy, upsert
+from crumb.orm.transactions import is_transaction, on_transaction_end
 from crumb.repository.base import ReadRepository
+from crumb.utils import hash_key
 from .model import BaseRegister, BaseRegisterResult
-from ...constants import EMPTY_TUPLE
+from ...constants import EMPTY_TUPLE, UndefinedValue
 
 if TYPE_CHECKING:
     from crumb.entities.documents import Document
@@ -13,7 +26,28 @@ R = TypeVar('R', bound=BaseRegister)
 RR = TypeVar('RR', bound=BaseRegisterResult)
 
 
-__all__ = ["BaseRegisterRepository"]
+__all__ = ["BaseRegisterRepository", "check_register_backends"]
+
+# {репозиторий: {ключ измерений: (значение итога, когда устареет)}}
+results_cache: dict[type, dict[tuple, tuple[Any, float]]] = {}
+# {репозиторий: сколько раз сбрасывался кэш}. Итоги, прочитанные до сброса, в кэш не попадают
+results_generation: dict[type, int] = {}
+movement_types: dict[type, type[tuple]] = {}
+
+
+def check_register_backends():
+    """
+    Запись движений и итогов регистров идет сырым SQL под asyncpg (ON CONFLICT, RETURNING, ANY($1), LOCK TABLE),
+    поэтому таблицы регистров должны быть в PostgreSQL с бэкендом asyncpg. Вызывается при подключении к БД
+    """
+    for app in Tortoise.apps.values():
+        for model in app.values():
+            if issubclass(model, (BaseRegister, BaseRegisterResult)) and not model._meta.abstract \
+                    and not supports_copy(model._meta.db):
+                raise ConfigurationError(
+                    f'{model.__name__}: регистры работают только с PostgreSQL через asyncpg, '
+                    f'а соединение {model._meta.default_connection} использует {model._meta.db.__class__.__name__}'
+                )
 
 
 class BaseRegisterRepository(Generic[R, RR], ReadRepository[R]):
@@ -21,6 +55,19 @@ class BaseRegisterRepository(Generic[R, RR], ReadRepository[R]):
     group_by: tuple[str, ...]
     main_field: str
     side_fields: tuple[str] = EMPTY_TUPLE
+    # Как вставлять движения. COPY работает только с asyncpg, иначе используется INSERT
+    insert_method: BulkInsertMethod = BulkInsertMethod.INSERT
+    # Значение, которое get_results возвращает для ключей без итога
+    result_default: Any = None
+    keys_batch_size: int = 1000
+    # Сколько секунд get_results хранит итоги в памяти процесса. None - бессрочно, 0 - не кэшировать.
+    # Записи этого процесса сбрасывают кэш по затронутым ключам (в транзакции - еще раз после ее завершения),
+    # записи других процессов - нет, поэтому бессрочный кэш подходит, только если пишет в регистр один процесс.
+    # Внутри транзакции кэш не используется: итоги читаются из БД с учетом незафиксированных записей.
+    results_cache_ttl: Optional[float] = 10
+    # Если задан, таблица движений партиционирована по dt на этот период (см. partitioning).
+    # Тогда удаление движений регистратора дополнительно ограничивается его dt, чтобы не обходить все партиции
+    partition_period: Optional[Period] = None
 
     @classmethod
     async def register(
@@ -28,56 +75,401 @@ class BaseRegisterRepository(Generic[R, RR], ReadRepository[R]):
             registrator: "Document",
             records: list[dict[str, Any]],
     ):
-        reg_number = registrator.unique_number
-        reg_dt = registrator.dt
+        await cls.register_many([(registrator, records)])
+
+    @classmethod
+    async def register_many(
+            cls,
+            items: list[tuple["Document", list[dict[str, Any]]]],
+    ):
+        """Записывает движения сразу нескольких регистраторов и один раз обновляет итоги"""
         instances: list[R] = [
             cls.model(
-                registrator=reg_number,
-                dt=reg_dt,
+                registrator=registrator.unique_number,
+                dt=registrator.dt,
                 **{name: rec[name] for name in (*cls.group_by, cls.main_field, *cls.side_fields)},
             )
+            for registrator, records in items
             for rec in records
         ]
-        instances = await cls.model.bulk_create(instances, batch_size=100)
-        await cls.update_results(instances)
+        if not instances:
+            return
+        await bulk_insert(cls.model, instances, method=cls.insert_method)
+        await cls.update_results(registered=instances)
 
     @classmethod
     async def unregister(cls, registrator: "Document"):
-        reg_number = registrator.unique_number
-        instances = await cls.model.filter(registrator=reg_number)
-        await cls.model.filter(registrator=reg_number).delete()
-        await cls.update_results(instances)
+        await cls.unregister_many([registrator])
+
+    @classmethod
+    async def unregister_many(cls, registrators: list["Document"]):
+        """Удаляет движения нескольких регистраторов одним запросом и один раз обновляет итоги"""
+        if not registrators:
+            return
+        await cls.update_results(unregistered=await cls.delete_movements(registrators))
+
+    @classmethod
+    async def replace_movements(
+            cls,
+            registrator: "Document",
+            records: list[dict[str, Any]],
+    ):
+        """
+        Заменяет движения регистратора на records и пишет только разницу с сохраненными:
+        совпадающие движения не трогаются, измененные по тем же измерениям обновляются, лишние удаляются,
+        новые вставляются. Итоги обновляются только по ключам измененных движений.
+        """
+        data_fields = (*cls.group_by, cls.main_field, *cls.side_fields, 'dt')
+        fields_map = cls.opts().fields_map
+        new_movements: list[R] = [
+            cls.model(
+                registrator=registrator.unique_number,
+                dt=registrator.dt,
+                **{name: fields_map[name].to_python_value(rec[name]) for name in data_fields if name != 'dt'},
+            )
+            for rec in records
+        ]
+        # dt документа могла измениться, поэтому без ограничения по dt даже при партиционировании
+        stored_movements = await cls.model.filter(registrator=registrator.unique_number)
+
+        def data_of(movement: R) -> tuple:
+            return tuple(getattr(movement, name) for name in data_fields)
+
+        stale: dict[tuple, list[R]] = {}
+        for movement in stored_movements:
+            stale.setdefault(data_of(movement), []).append(movement)
+        changed: list[R] = []
+        for movement in new_movements:
+            same = stale.get(data_of(movement))
+            if same:
+                same.pop()
+            else:
+                changed.append(movement)
+
+        stale_by_key: dict[tuple, list[R]] = {}
+        for movements in stale.values():
+            for movement in movements:
+                stale_by_key.setdefault(cls.key_of(movement), []).append(movement)
+        movement_type = cls.movement_type()
+        to_create: list[R] = []
+        to_update: list[R] = []
+        unregistered: list[R | tuple] = []
+        for movement in changed:
+            candidates = stale_by_key.get(cls.key_of(movement))
+            if candidates:
+                instance = candidates.pop()
+                unregistered.append(movement_type(*(getattr(instance, name) for name in movement_type._fields)))
+                for name in data_fields:
+                    setattr(instance, name, getattr(movement, name))
+                to_update.append(instance)
+            else:
+                to_create.append(movement)
+        to_delete = [movement for movements in stale_by_key.values() for movement in movements]
+        unregistered.extend(to_delete)
+
+        if to_delete:
+            await cls.model.filter(id__in=[movement.id for movement in to_delete]).delete()
+        if to_update:
+            await cls.model.bulk_update(to_update, fields=[cls.main_field, *cls.side_fields, 'dt'])
+        if to_create:
+            await bulk_insert(cls.model, to_create, method=cls.insert_method)
+        if to_update or to_create or unregistered:
+            await cls.update_results(registered=[*to_update, *to_create], unregistered=unregistered)
+
+    @classmethod
+    def movement_fields(cls) -> tuple[str, ...]:
+        """Поля движений, которые нужны update_results"""
+        return *cls.group_by, cls.main_field, 'dt'
+
+    @classmethod
+    def movement_type(cls) -> type[tuple]:
+        """Легкая замена модели для движений, прочитанных сырым запросом"""
+        movement_type = movement_types.get(cls)
+        if movement_type is None:
+            movement_types[cls] = movement_type = namedtuple(f'{cls.model.__name__}Movement', cls.movement_fields())
+        return movement_type
+
+    @classmethod
+    async def delete_movements(cls, registrators: list["Document"]) -> list[tuple]:
+        """Удаляет движения регистраторов и в том же запросе возвращает их movement_fields"""
+        movement_type = cls.movement_type()
+        returning = ', '.join(f'{cls.column(field_name)} AS "{field_name}"' for field_name in movement_type._fields)
+        where = f'{cls.column("registrator")} = ANY($1)'
+        values = [[registrator.unique_number for registrator in registrators]]
+        if cls.partition_period:
+            where += f' AND {cls.column("dt")} = ANY($2)'
+            values.append(list({registrator.dt for registrator in registrators}))
+        rows = await cls.opts().db.execute_query_dict(
+            f'DELETE FROM "{cls.opts().db_table}" '
+            f'WHERE {where} '
+            f'RETURNING {returning}',
+            values
+        )
+        return [movement_type(**row) for row in rows]
 
     @classmethod
     async def calc_results(
             cls,
-            time_point: datetime = None
+            time_point: datetime = None,
+            *,
+            first_dim_values: Optional[list] = None,
     ) -> list[dict[str, Any]]:
+        """
+        :param first_dim_values: Считать итоги только для этих значений первого измерения group_by.
+        """
         pass
 
+    @classmethod
+    def key_of(cls, movement: R | RR) -> tuple:
+        """Значения измерений (group_by) записи регистра или его итога"""
+        return tuple(getattr(movement, field_name) for field_name in cls.group_by)
+
+    @classmethod
+    def result_id(cls, key: tuple) -> int:
+        """
+        id итога - 64-битный хэш значений измерений. Сравнение и поиск по нему идут по одному bigint,
+        сколько бы измерений ни было в group_by
+        """
+        return hash_key(key)
+
+    @classmethod
+    def column(cls, field_name: str) -> str:
+        """Имя колонки поля регистра в БД для сырых запросов"""
+        return f'"{cls.opts().fields_db_projection[field_name]}"'
+
+    @classmethod
+    def keys_condition(cls, keys: list[tuple], first_param: int = 1) -> tuple[str, list[Any]]:
+        """SQL-условие `(измерения) IN (...)` по ключам и параметры к нему"""
+        size = len(cls.group_by)
+        rows = ', '.join(
+            '(' + ', '.join(f'${first_param + i * size + j}' for j in range(size)) + ')'
+            for i in range(len(keys))
+        )
+        columns = ', '.join(cls.column(field_name) for field_name in cls.group_by)
+        return f'({columns}) IN ({rows})', [value for key in keys for value in key]
+
+    @classmethod
+    def make_result(cls, key: tuple, value: Any) -> RR:
+        instance: RR = cls.results.model()
+        for field_name, field_value in zip(cls.group_by, key):
+            setattr(instance, field_name, field_value)
+        setattr(instance, cls.main_field, value)
+        instance.id = cls.result_id(key)
+        return instance
+
     @classmethod
     async def set_results(cls, values: list[dict[str, Any]]):
-        instances = []
-        for value in values:
-            instance: RR = cls.results.model()
-            for field in cls.group_by:
-                setattr(instance, field, value[field])
-            setattr(instance, cls.main_field, value['result'])
-            instance.id = ','.join(str(getattr(instance, field_name)) for field_name in cls.group_by)
-            instances.append(instance)
+        instances = [
+            cls.make_result(tuple(value[field_name] for field_name in cls.group_by), value['result'])
+            for value in values
+        ]
         await cls.results.model.bulk_create(instances)
 
+    @classmethod
+    async def get_result_instances(cls, keys: Iterable[tuple], for_update: bool = False) -> dict[tuple, RR]:
+        """Итоги по ключам измерений. Ключи, по которым итогов нет, в результат не попадают"""
+        keys_by_id = {cls.result_id(key): key for key in keys}
+        if not keys_by_id:
+            return {}
+        query = cls.results.model.filter(id__in=list(keys_by_id))
+        if for_update:
+            query = query.select_for_update()
+        return {keys_by_id[instance.id]: instance for instance in await query}
+
+    @classmethod
+    async def write_results(cls, values: dict[tuple, Any]):
+        """
+        Записывает новые значения итогов по ключам измерений одним INSERT ... ON CONFLICT DO UPDATE,
+        поэтому параллельные записи по новому ключу не падают на первичном ключе.
+        :param values: Значение UndefinedValue означает, что итог по ключу нужно удалить.
+        """
+        to_write: list[RR] = []
+        to_delete: list[int] = []
+        for key, value in values.items():
+            if value is UndefinedValue:
+                to_delete.append(cls.result_id(key))
+            else:
+                to_write.append(cls.make_result(key, value))
+        opts = cls.results.opts()
+        if to_delete:
+            await opts.db.execute_query(f'DELETE FROM "{opts.db_table}" WHERE "id" = ANY($1)', [to_delete])
+        if to_write:
+            main = f'"{opts.fields_db_projection[cls.main_field]}"'
+            await upsert(cls.results.model, to_write, update=f'{main} = EXCLUDED.{main}, "dt" = EXCLUDED."dt"')
+        cls.results_written(values.keys())
+
+    @classmethod
+    async def get_results(cls, keys: Iterable[tuple]) -> dict[tuple, Any]:
+        """
+        Значения итогов (main_field) по ключам измерений пачками по keys_batch_size.
+        Для ключей без итога возвращается result_default.
+        """
+        now = monotonic()
+        use_cache = cls.results_cache_ttl != 0 and not is_transaction(cls.results.opts().db)
+        cache = results_cache.setdefault(cls, {}) if use_cache else {}
+        result = {}
+        missed = []
+        for key in set(keys):
+            cached = cache.get(key)
+            if cached is not None and cached[1] > now:
+                result[key] = cached[0]
+            else:
+                missed.append(key)
+
+        expires = now + cls.results_cache_ttl if cls.results_cache_ttl else float('inf')
+        for i in range(0, len(missed), cls.keys_batch_size):
+            batch = missed[i:i + cls.keys_batch_size]
+            generation = results_generation.get(cls, 0)
+            instances = await cls.get_result_instances(batch)
+            # пока шел запрос, итоги могли измениться и кэш сброситься: прочитанное может быть уже устаревшим
+            store = use_cache and generation == results_generation.get(cls, 0)
+            for key in batch:
+                instance = instances.get(key)
+                result[key] = getattr(instance, cls.main_field) if instance else cls.result_default
+                if store:
+                    cache[key] = (result[key], expires)
+        return result
+
+    @classmethod
+    async def get_result(cls, key: tuple) -> Any:
+        """Значение итога по значениям измерений в порядке group_by"""
+        return (await cls.get_results([key]))[key]
+
+    @classmethod
+    def invalidate_results(cls, keys: Optional[Iterable[tuple]] = None):
+        """Сбрасывает кэш get_results по ключам, а без ключей - полностью"""
+        results_generation[cls] = results_generation.get(cls, 0) + 1
+        cache = results_cache.get(cls)
+        if not cache:
+            return
+        if keys is None:
+            cache.clear()
+            return
+        for key in keys:
+            cache.pop(key, None)
+
+    @classmethod
+    def results_written(cls, keys: Optional[Iterable[tuple]] = None):
+        """
+        Сбрасывает кэш по ключам (без ключей - полностью), итоги которых только что записаны.
+        Если запись идет в транзакции, кэш сбрасывается еще раз после commit или rollback: до их завершения
+        другие соединения видят прежние значения и могут снова положить их в кэш.
+        """
+        keys = None if keys is None else list(keys)
+        cls.invalidate_results(keys)
+        on_transaction_end(cls.results.opts().db, lambda: cls.invalidate_results(keys))
+
     @classmethod
     async def reset_results(cls):
         await cls.results.model.all().delete()
         await cls.set_results(await cls.calc_results())
+        cls.results_written()
 
     @classmethod
-    async def update_results(cls, instances: list[R]):
-        # groups = [
-        #     tuple(getattr(instance, field_name) for field_name in cls.group_by)
-        #     for instance in instances
-        # ]
-        # await cls.set_results(await cls.calc_results(groups=groups))
-        # TODO: сделать, чтобы обновлять можно было частично
+    def lock_movements_query(cls) -> str:
+        """
+        Блокировка таблицы движений, при которой их запись (register/unregister) ждет, а чтение - нет.
+        SHARE ROW EXCLUSIVE конфликтует сама с собой, поэтому два пересчета итогов не идут одновременно
+        """
+        return f'LOCK TABLE "{cls.opts().db_table}" IN SHARE ROW EXCLUSIVE MODE'
+
+    @classmethod
+    async def rebuild_results(
+            cls,
+            shards: int = 4,
+            on_progress: Optional[Callable[[int, int], Any]] = None,
+    ):
+        """
+        Полный пересчет итогов, разбитый на shards частей по хэшу первого измерения group_by.
+        Части считаются и пишутся параллельно, каждая в своей транзакции на своем соединении из пула,
+        во временную таблицу, откуда итоги одной транзакцией подменяются целиком.
+        Проведения во время подсчета частей не блокируются. Перед подсчетом запоминаются версии (xmin) строк
+        текущих итогов: запись движений обновляет итоги своих ключей, поэтому строки, которые с тех пор
+        изменились, появились или удалились, - это ключи, тронутые во время пересчета. В транзакции подмены
+        таблица движений блокируется (lock_movements_query), и заново считаются только значения первого
+        измерения этих ключей, сколько бы ни расходились старые итоги с движениями.
+        Запись движений ждет только транзакцию подмены, чтение не ждет.
+        Ограничение: не заметен ключ, которого не было в итогах, если во время пересчета у него удалили все
+        движения и итог так и не был записан (бывает у InfoRegister при устаревших итогах) - после пересчета
+        по нему останется значение на момент подсчета части.
+        Вызывать можно только вне транзакции. Без asyncpg выполняется обычный reset_results.
+        :param on_progress: Вызывается (можно async) после каждой части с числом готовых частей и их общим числом.
+        """
+        results_opts = cls.results.opts()
+        db = results_opts.db
+        if not supports_copy(db):
+            await cls.reset_results()
+            return
+
+        table = f'"{results_opts.db_table}"'
+        first_dim = cls.group_by[0]
+        first_column = f'"{results_opts.fields_db_projection[first_dim]}"'
+        # имена уникальны, чтобы одновременные пересчеты не удалили временные таблицы друг у друга
+        suffix = uuid4().hex[:8]
+        staging_name = f'{results_opts.db_table}__rebuild_{suffix}'
+        staging = f'"{staging_name}"'
+        versions = f'"{results_opts.db_table}__versions_{suffix}"'
+        await db.execute_script(
+            f'CREATE UNLOGGED TABLE {staging} (LIKE {table} INCLUDING DEFAULTS); '
+            f'CREATE UNLOGGED TABLE {versions} AS SELECT "id", {first_column}, xmin::text AS "version" FROM {table};'
+        )
+        try:
+            parts: list[list] = [[] for _ in range(shards)]
+            for value in await cls.model.all().distinct().values_list(first_dim, flat=True):
+                parts[hash_key((value,)) % shards].append(value)
+
+            done = 0
+
+            async def rebuild_shard(values: list):
+                nonlocal done
+                if values:
+                    async with in_transaction():
+                        await cls.calc_results_into(staging_name, values)
+                done += 1
+                if on_progress:
+                    progress = on_progress(done, shards)
+                    if isawaitable(progress):
+                        await progress
+
+            await asyncio.gather(*(rebuild_shard(values) for values in parts))
+
+            async with in_transaction() as conn:
+                await conn.execute_script(cls.lock_movements_query())
+                changed = await conn.execute_query_dict(
+                    f'SELECT DISTINCT COALESCE(r.{first_column}, v.{first_column}) AS "value" '
+                    f'FROM {versions} v FULL JOIN {table} r ON r."id" = v."id" '
+                    f'WHERE v."id" IS NULL OR r."id" IS NULL OR v."version" <> r.xmin::text'
+                )
+                if changed:
+                    values = [row['value'] for row in changed]
+                    await conn.execute_query(f'DELETE FROM {staging} WHERE {first_column} = ANY($1)', [values])
+                    await cls.calc_results_into(staging_name, values)
+                await conn.execute_script(f'DELETE FROM {table}; INSERT INTO {table} SELECT * FROM {staging};')
+            cls.invalidate_results()
+        finally:
+            await db.execute_script(f'DROP TABLE IF EXISTS {staging}; DROP TABLE IF EXISTS {versions};')
+
+    @classmethod
+    async def calc_results_into(cls, db_table: str, first_dim_values: list):
+        """Считает итоги по значениям первого измерения и вставляет их через COPY в таблицу db_table"""
+        await copy_insert(
+            cls.results.model,
+            [
+                cls.make_result(tuple(row[name] for name in cls.group_by), row['result'])
+                for row in await cls.calc_results(first_dim_values=first_dim_values)
+            ],
+            db_table=db_table,
+        )
+
+    @classmethod
+    async def update_results(
+            cls,
+            registered: list[R] = EMPTY_TUPLE,
+            unregistered: list[R] = EMPTY_TUPLE,
+    ):
+        """
+        Обновляет итоги после записи (registered) и удаления (unregistered) движений.
+        Движения - это экземпляры модели или movement_type, у них гарантированно есть только movement_fields.
+        По умолчанию итоги пересчитываются полностью, наследники могут обновлять их частично.
+        """
         await cls.reset_results()
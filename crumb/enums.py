@@ -1,7 +1,10 @@
+from datetime import datetime, timedelta
 from enum import StrEnum
 
+from tortoise import timezone
 
-__all__ = ["FieldTypes", "NotifyStatus"]
+
+__all__ = ["FieldTypes", "NotifyStatus", "Period", "BulkInsertMethod", "SaveReturning", "CountStrategy", "RepostingState"]
 
 
 class FieldTypes(StrEnum):
@@ -125,3 +128,62 @@ class NotifyStatus(StrEnum):
     SUCCESS = 'success'
     WARN = 'warn'
     ERROR = 'error'
+
+
+class Period(StrEnum):
+    DAY = 'day'
+    MONTH = 'month'
+    YEAR = 'year'
+
+    def start(self, dt: datetime) -> datetime:
+        """Начало периода, в который попадает dt (в часовом поясе из настроек tortoise)"""
+        is_aware = timezone.is_aware(dt)
+        value = timezone.make_naive(dt) if is_aware else dt
+        value = value.replace(hour=0, minute=0, second=0, microsecond=0)
+        if self is not Period.DAY:
+            value = value.replace(day=1)
+        if self is Period.YEAR:
+            value = value.replace(month=1)
+        return timezone.make_aware(value) if is_aware else value
+
+    def next_start(self, dt: datetime) -> datetime:
+        """Начало следующего периода после того, в который попадает dt"""
+        start = self.start(dt)
+        is_aware = timezone.is_aware(start)
+        value = timezone.make_naive(start) if is_aware else start
+        if self is Period.DAY:
+            value += timedelta(days=1)
+        elif self is Period.MONTH:
+            value = value.replace(year=value.year + value.month // 12, month=value.month % 12 + 1)
+        else:
+            value = value.replace(year=value.year + 1)
+        return timezone.make_aware(value) if is_aware else value
+
+
+class BulkInsertMethod(StrEnum):
+    INSERT = 'insert'
+    COPY = 'copy'
+
+
+class SaveReturning(StrEnum):
+    """Что возвращают Repository.create и Repository.edit"""
+    FULL = 'full'  # запись, заново прочитанная через get_one со всеми select_related и prefetch_related
+    INSTANCE = 'instance'  # запись из памяти с только что записанными вложенными объектами
+    PK = 'pk'
+
+
+class CountStrategy(StrEnum):
+    """Как ReadRepository.get_all считает общее количество записей"""
+    EXACT = 'exact'  # отдельный COUNT(*) в той же транзакции
+    WINDOW = 'window'  # COUNT(*) OVER() в запросе страницы, без второго запроса
+    CACHED = 'cached'  # точный COUNT(*), который переиспользуется для тех же фильтров count_cache_ttl секунд
+    ESTIMATE = 'estimate'  # оценка планировщика postgres для таблиц без фильтров, иначе точный подсчет
+
+
+class RepostingState(StrEnum):
+    """Состояние задачи перепроведения RepostingTask"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    CANCELLED = 'cancelled'
+    FAILED = 'failed'
@@ -0,0 +1,139 @@
+from typing import Type, Iterable, Optional
+
+from tortoise import BaseDBAsyncClient
+
+from crumb.enums import BulkInsertMethod
+from .base_model import BaseModel
+
+try:
+    from tortoise.backends.asyncpg import AsyncpgDBClient
+except ImportError:  # asyncpg не установлен
+    AsyncpgDBClient = None
+
+
+__all__ = ["bulk_insert", "copy_insert", "insert_returning_pk", "upsert", "supports_copy"]
+
+
+def supports_copy(db: BaseDBAsyncClient) -> bool:
+    return AsyncpgDBClient is not None and isinstance(db, AsyncpgDBClient)
+
+
+async def bulk_insert(
+        model: Type[BaseModel],
+        instances: list[BaseModel],
+        method: BulkInsertMethod = BulkInsertMethod.INSERT,
+        batch_size: int = 100,
+) -> None:
+    """
+    Вставляет много записей. COPY используется только с asyncpg, для остальных бэкендов - INSERT пачками.
+    COPY не возвращает сгенерированные БД значения, поэтому автоинкрементный pk у instances не заполняется
+    (как и при bulk_create).
+    """
+    if not instances:
+        return
+    if method is BulkInsertMethod.COPY and supports_copy(model._meta.db):
+        await copy_insert(model, instances)
+    else:
+        await model.bulk_create(instances, batch_size=batch_size)
+
+
+async def copy_insert(
+        model: Type[BaseModel],
+        instances: Iterable[BaseModel],
+        db_table: Optional[str] = None,
+) -> None:
+    """
+    Вставка через бинарный COPY asyncpg.
+    :param db_table: Таблица, в которую вставлять, если не таблица модели (например, копия с той же структурой).
+    """
+    opts = model._meta
+    field_names = [
+        name for name in opts.fields_db_projection
+        if not opts.fields_map[name].generated
+    ]
+    fields = [opts.fields_map[name] for name in field_names]
+    records = [
+        tuple(field.to_db_value(getattr(instance, name), instance) for name, field in zip(field_names, fields))
+        for instance in instances
+    ]
+    async with opts.db.acquire_connection() as connection:
+        await connection.copy_records_to_table(
+            db_table or opts.db_table,
+            records=records,
+            columns=[opts.fields_db_projection[name] for name in field_names],
+        )
+
+
+async def insert_returning_pk(
+        model: Type[BaseModel],
+        instances: list[BaseModel],
+        batch_size: int = 1000,
+) -> None:
+    """
+    Вставляет записи пачками и, в отличие от bulk_create, заполняет у instances сгенерированный БД pk.
+    Многострочный INSERT ... RETURNING есть только у asyncpg, на остальных бэкендах записи сохраняются по одной.
+    """
+    if not instances:
+        return
+    opts = model._meta
+    db = opts.db
+    if not supports_copy(db):
+        for instance in instances:
+            await instance.save(using_db=db, force_create=True)
+        return
+    for batch, query, values in _insert_batches(model, instances, batch_size):
+        result = await db.execute_query_dict(
+            f'{query} RETURNING "{opts.fields_db_projection[opts.pk_attr]}" AS "pk"',
+            values,
+        )
+        # postgres возвращает строки в порядке VALUES
+        for instance, row in zip(batch, result):
+            instance.pk = opts.pk.to_python_value(row['pk'])
+            instance._saved_in_db = True
+
+
+async def upsert(
+        model: Type[BaseModel],
+        instances: list[BaseModel],
+        update: str,
+        batch_size: int = 1000,
+) -> None:
+    """
+    INSERT ... ON CONFLICT (pk) DO UPDATE пачками. В отличие от чтения с select_for_update и последующих
+    bulk_create/bulk_update атомарно и для строк, которых еще нет: параллельные вставки того же pk
+    не падают на первичном ключе, а дожидаются друг друга и применяют update.
+    Записи вставляются в порядке pk, чтобы параллельные upsert одних и тех же строк не блокировали друг друга.
+    :param update: Выражение SET, к текущей строке обращаться по имени таблицы, к вставляемой - через EXCLUDED.
+    """
+    if not instances:
+        return
+    opts = model._meta
+    instances = sorted(instances, key=lambda instance: instance.pk)
+    for _, query, values in _insert_batches(model, instances, batch_size):
+        await opts.db.execute_query(
+            f'{query} ON CONFLICT ("{opts.fields_db_projection[opts.pk_attr]}") DO UPDATE SET {update}',
+            values,
+        )
+
+
+def _insert_batches(model: Type[BaseModel], instances: list[BaseModel], batch_size: int):
+    """(пачка, INSERT ... VALUES без RETURNING, параметры) для многострочной вставки instances"""
+    opts = model._meta
+    field_names = [
+        name for name in opts.fields_db_projection
+        if not opts.fields_map[name].generated
+    ]
+    fields = [opts.fields_map[name] for name in field_names]
+    columns = ', '.join(f'"{opts.fields_db_projection[name]}"' for name in field_names)
+    # У postgres не больше 32767 параметров в запросе
+    batch_size = max(1, min(batch_size, 32767 // max(len(field_names), 1)))
+    for start in range(0, len(instances), batch_size):
+        batch = instances[start:start + batch_size]
+        values = []
+        rows = []
+        for instance in batch:
+            rows.append('(' + ', '.join(f'${len(values) + i + 1}' for i in range(len(field_names))) + ')')
+            values.extend(
+                field.to_db_value(getattr(instance, name), instance) for name, field in zip(field_names, fields)
+            )
+        yield batch, f'INSERT INTO "{opts.db_table}" ({columns}) VALUES {", ".join(rows)}', values
@@ -2,11 +2,13 @@ import importlib
 
 from tortoise import Tortoise
 
+from crumb.entities.registers import check_register_backends
 from crumb.utils import get_settings
 
 
 async def init():
     await Tortoise.init(config=get_settings().DATABASE)
+    check_register_backends()
     importlib.import_module('configuration.repositories')
 
 
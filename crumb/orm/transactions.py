@@ -0,0 +1,42 @@
+from typing import Callable, Any, Coroutine
+
+from tortoise import BaseDBAsyncClient
+from tortoise.backends.base.client import BaseTransactionWrapper
+
+
+__all__ = ["is_transaction", "on_transaction_end"]
+
+
+def is_transaction(db: BaseDBAsyncClient) -> bool:
+    """Выполняются ли запросы через db внутри транзакции (in_transaction)"""
+    return isinstance(db, BaseTransactionWrapper)
+
+
+def on_transaction_end(db: BaseDBAsyncClient, callback: Callable[[], Any]) -> bool:
+    """
+    Вызывает callback после commit или rollback транзакции db. Вложенные in_transaction работают через
+    ту же обертку, что и внешняя, поэтому callback срабатывает, когда завершается внешняя транзакция.
+    Если db не в транзакции, callback не вызывается и возвращается False.
+    """
+    if not is_transaction(db):
+        return False
+    callbacks: list[Callable[[], Any]] = db.__dict__.get('_end_callbacks')
+    if callbacks is None:
+        callbacks = db._end_callbacks = []
+        db.commit = _notifying(db.commit, callbacks)
+        db.rollback = _notifying(db.rollback, callbacks)
+    callbacks.append(callback)
+    return True
+
+
+def _notifying(
+        method: Callable[[], Coroutine[..., ..., None]],
+        callbacks: list[Callable[[], Any]],
+) -> Callable[[], Coroutine[..., ..., None]]:
+    async def wrapper():
+        try:
+            await method()
+        finally:
+            while callbacks:
+                callbacks.pop(0)()
+    return wrapper
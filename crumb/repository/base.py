@@ -1,19 +1,24 @@
-from typing import Generic, Type, cast, Optional, TypeVar, overload
+from time import monotonic
+from typing import Generic, Type, cast, Optional, TypeVar, overload, Sequence
 
 from tortoise import fields
+from tortoise.expressions import RawSQL
 from tortoise.models import MetaInfo
 from tortoise.queryset import QuerySet, Q
 from tortoise.transactions import in_transaction
 
 from crumb.constants import UndefinedValue, EMPTY_TUPLE
-from crumb.enums import FieldTypes
+from crumb.enums import FieldTypes, CountStrategy
 from crumb.exceptions import ItemNotFound
 from crumb.filters import BaseFilter
 from crumb.maps import field_instance_to_type
 from crumb.orm import BaseModel
-from crumb.types import MODEL, PK, RepositoryDescription
+from crumb.types import MODEL, PK, RepositoryDescription, Page, Total, ProjectionRow
+from .keyset import encode_cursor, decode_cursor, keyset_order, keyset_condition, keyset_values
 
 descriptions = {}
+# {(модель, SQL подсчета): (количество, когда устареет)}
+counts_cache: dict[tuple[type, str], tuple[int, float]] = {}
 REPOSITORY = TypeVar('REPOSITORY', bound=Type["BaseRepository"])
 
 
@@ -229,6 +234,10 @@ class BaseRepository(Generic[MODEL]):
 
 
 class ReadRepository(BaseRepository[MODEL]):
+    count_strategy: CountStrategy = CountStrategy.EXACT
+    count_cache_ttl: float = 30
+    # Для ESTIMATE: если оценка меньше, считается точно, это дешево
+    estimate_count_min: int = 100_000
 
     def __init__(
             self,
@@ -270,10 +279,18 @@ class ReadRepository(BaseRepository[MODEL]):
             limit: Optional[int],
             sort: list[str],
             filters: list[BaseFilter],
-    ) -> tuple[list[MODEL], int]:
+            count_strategy: Optional[CountStrategy] = None,
+            projection: Optional[Sequence[str]] = None,
+    ) -> tuple[list[MODEL] | list[ProjectionRow], Total]:
+        """
+        :param count_strategy: По умолчанию self.count_strategy
+        :param projection: Поля, которые нужны вызывающему, см. fetch
+        """
+        count_strategy = count_strategy or self.count_strategy
         query = self.get_queryset()
         for f in filters:
             query = f.filter(query)
+        filtered_query = query
         count_query = query.count()
         if sort:
             query = query.order_by(*sort)
@@ -281,11 +298,166 @@ class ReadRepository(BaseRepository[MODEL]):
             query = query.offset(skip)
         if limit:
             query = query.limit(limit)
-        async with in_transaction():
-            result = await query
-            count = await count_query
+        if count_strategy == CountStrategy.WINDOW:
+            result = await self.fetch(
+                query.annotate(crumb_window_total=RawSQL('COUNT(*) OVER()')),
+                projection,
+                extra_columns=('crumb_window_total',),
+            )
+            if result:
+                return result, Total(getattr(result[0], 'crumb_window_total'))
+            # На пустой странице (например, skip за концом) окну нечего вернуть
+            return result, Total(await count_query)
+
+        if count_strategy == CountStrategy.ESTIMATE and not filters and not self.qs_default_filters():
+            estimate = await self.estimate_count()
+            if estimate is not None and estimate >= self.estimate_count_min:
+                return await self.fetch(query, projection), Total(estimate, estimated=True)
+
+        if count_strategy == CountStrategy.CACHED:
+            key = (self.model, count_query.sql())
+            cached = counts_cache.get(key)
+            if cached is not None and cached[1] > monotonic():
+                return await self.fetch(query, projection), Total(cached[0])
+            result, count = await self._fetch_with_count(query, filtered_query, projection)
+            counts_cache[key] = (count, monotonic() + self.count_cache_ttl)
+            return result, Total(count)
+
+        result, count = await self._fetch_with_count(query, filtered_query, projection)
+        return result, Total(count)
+
+    async def _fetch_with_count(
+            self,
+            query: QuerySet[MODEL],
+            filtered_query: QuerySet[MODEL],
+            projection: Optional[Sequence[str]],
+    ) -> tuple[list[MODEL] | list[ProjectionRow], int]:
+        """
+        Страница и количество в одной транзакции, т.е. по одному снимку данных. Запросы уже привязаны
+        к соединению, на котором созданы, поэтому переносятся на соединение транзакции через using_db
+        """
+        async with in_transaction() as conn:
+            result = await self.fetch(query.using_db(conn), projection)
+            count = await filtered_query.using_db(conn).count()
         return result, count
 
+    def projection_plan(
+            self,
+            field_names: Sequence[str],
+    ) -> Optional[tuple[list[str], dict[str, fields.relational.RelationalField]]]:
+        """
+        Колонки для values() и o2o/fk, которые нужно догрузить, чтобы показать field_names.
+        None, если какое-то поле нельзя получить без экземпляра модели (calculated, back_o2o, back_fk и т.п.)
+        """
+        description = self.describe()
+        annotations = {**self.qs_annotate_fields(), **(self.annotations or {})}
+        columns = [self.opts().pk_attr]
+        relations: dict[str, fields.relational.RelationalField] = {}
+        for name in field_names:
+            field_type = self.get_field_type(name)
+            if name in annotations or field_type.is_db_field():
+                columns.append(name)
+            elif field_type.is_hidden() and name in self.opts().fields_db_projection:
+                # скрытые поля нельзя менять через репозиторий, но показывать в списке можно
+                columns.append(name)
+            elif field_type in (FieldTypes.FK, FieldTypes.O2O):
+                relations[name] = getattr(description, field_type.value)[name]
+            elif field_type in (FieldTypes.FK_PK, FieldTypes.O2O_PK):
+                relation = getattr(description, field_type.value)[name].reference
+                relations[relation.model_field_name] = relation
+            else:
+                return None
+        columns.extend(relation.source_field for relation in relations.values())
+        return list(dict.fromkeys(columns)), relations
+
+    async def fetch(
+            self,
+            query: QuerySet[MODEL],
+            projection: Optional[Sequence[str]] = None,
+            extra_columns: Sequence[str] = EMPTY_TUPLE,
+    ) -> list[MODEL] | list[ProjectionRow]:
+        """
+        Выполняет query. Если передан projection, вместо экземпляров модели читаются только нужные колонки
+        (values), а o2o/fk догружаются одним запросом на связь для всей страницы. Если projection так
+        получить нельзя, возвращаются обычные экземпляры.
+        """
+        plan = self.projection_plan(projection) if projection is not None else None
+        if plan is None:
+            return await query
+        columns, relations = plan
+        rows = [ProjectionRow(**row) for row in await query.values(*dict.fromkeys([*columns, *extra_columns]))]
+        pk_attr = self.opts().pk_attr
+        for row in rows:
+            row.pk = getattr(row, pk_attr)
+        for name, relation in relations.items():
+            related_pks = {getattr(row, relation.source_field) for row in rows} - {None}
+            related = {}
+            if related_pks:
+                related = {i.pk: i for i in await relation.related_model.filter(pk__in=list(related_pks))}
+            for row in rows:
+                setattr(row, name, related.get(getattr(row, relation.source_field)))
+        return rows
+
+    async def estimate_count(self) -> Optional[int]:
+        """Оценка количества записей таблицы по статистике postgres. None, если ее нет или БД не postgres"""
+        db = self.opts().db
+        if db.capabilities.dialect != 'postgres':
+            return None
+        rows = await db.execute_query_dict(
+            f"""SELECT reltuples::bigint AS estimate FROM pg_class WHERE oid = to_regclass('"{self.opts().db_table}"')"""
+        )
+        # -1 - таблица еще ни разу не анализировалась
+        if not rows or rows[0]['estimate'] is None or rows[0]['estimate'] < 0:
+            return None
+        return rows[0]['estimate']
+
+    async def get_page(
+            self,
+            cursor: Optional[str],
+            limit: int,
+            sort: list[str],
+            filters: list[BaseFilter],
+            projection: Optional[Sequence[str]] = None,
+    ) -> Page[MODEL]:
+        """
+        Keyset-пагинация: вместо OFFSET страница отсекается условием по значениям sort и pk граничной записи
+        соседней страницы, которые хранит курсор. Скорость не зависит от номера страницы, а вставки не сдвигают
+        записи между страницами. Колонки sort не должны содержать NULL, для скорости нужен индекс по (sort..., pk).
+        :param cursor: None - первая страница, иначе next_cursor или prev_cursor предыдущего Page.
+        :param projection: Поля, которые нужны вызывающему, см. fetch. Не работает с сортировкой по связям.
+        """
+        query = self.get_queryset()
+        for f in filters:
+            query = f.filter(query)
+        order = keyset_order(sort, self.opts().pk_attr)
+        backward = False
+        if cursor is not None:
+            backward, values = decode_cursor(cursor)
+            query = query.filter(keyset_condition(order, values, backward))
+        query_order = [name[1:] if name.startswith('-') else f'-{name}' for name in order] if backward else order
+        if projection is not None and any('__' in name for name in order):
+            # значения сортировки по связям для курсора есть только у экземпляров
+            projection = None
+        items = await self.fetch(
+            query.order_by(*query_order).limit(limit + 1),
+            projection,
+            extra_columns=[name.lstrip('-') for name in order],
+        )
+        has_more = len(items) > limit
+        items = items[:limit]
+        if backward:
+            items.reverse()
+        if not items:
+            return Page(items=items)
+        # В сторону движения соседняя страница есть, если запрос вернул лишнюю запись,
+        # в обратную - если мы пришли по курсору
+        has_next, has_prev = (cursor is not None, has_more) if backward else (has_more, cursor is not None)
+        return Page(
+            items=items,
+            next_cursor=encode_cursor(keyset_values(items[-1], order)) if has_next else None,
+            prev_cursor=encode_cursor(keyset_values(items[0], order), backward=True) if has_prev else None,
+        )
+
     def _get_many_queryset(self, item_pk_list: list[PK]) -> QuerySet[MODEL]:
         return self.get_queryset().filter(pk__in=item_pk_list)
 
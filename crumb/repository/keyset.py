@@ -0,0 +1,88 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime, date
+from decimal import Decimal
+from enum import Enum
+from typing import Any
+from uuid import UUID
+
+from tortoise.queryset import Q
+
+from crumb.orm import BaseModel
+
+
+__all__ = ["encode_cursor", "decode_cursor", "keyset_order", "keyset_condition", "keyset_values"]
+
+# Типы, которые json не сохраняет, хранятся в курсоре как {метка: строка}
+_encoders = (
+    (datetime, '$dt', datetime.isoformat, datetime.fromisoformat),
+    (date, '$d', date.isoformat, date.fromisoformat),
+    (Decimal, '$dec', str, Decimal),
+    (UUID, '$uuid', str, UUID),
+)
+
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, Enum):
+        value = value.value
+    for value_type, tag, encode, _ in _encoders:
+        if isinstance(value, value_type):
+            return {tag: encode(value)}
+    return value
+
+
+def _decode_value(value: Any) -> Any:
+    if isinstance(value, dict):
+        for _, tag, _, decode in _encoders:
+            if tag in value:
+                return decode(value[tag])
+    return value
+
+
+def encode_cursor(values: list[Any], backward: bool = False) -> str:
+    """Непрозрачный курсор: значения колонок сортировки граничной записи и направление"""
+    payload = json.dumps({'b': backward, 'v': [_encode_value(v) for v in values]}, separators=(',', ':'))
+    return urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[bool, list[Any]]:
+    try:
+        payload = json.loads(urlsafe_b64decode(cursor.encode()))
+        return bool(payload['b']), [_decode_value(v) for v in payload['v']]
+    except (ValueError, KeyError, TypeError):
+        raise ValueError(f'Некорректный курсор {cursor}')
+
+
+def keyset_order(sort: list[str], pk_attr: str) -> list[str]:
+    """sort с pk в конце, чтобы порядок был однозначным. Направление pk берется у последней колонки"""
+    order = [name for name in sort if name.lstrip('-') not in ('pk', pk_attr)]
+    pk_desc = bool(sort) and sort[-1].startswith('-')
+    return [*order, f'-{pk_attr}' if pk_desc else pk_attr]
+
+
+def keyset_condition(order: list[str], values: list[Any], backward: bool = False) -> Q:
+    """
+    Записи строго после (backward - до) записи со значениями values в порядке order:
+    (a > va) OR (a = va AND b > vb) OR ...
+    """
+    if len(order) != len(values):
+        raise ValueError('Курсор не соответствует сортировке')
+    condition = None
+    for i, name in enumerate(order):
+        column = name.lstrip('-')
+        ascending = name.startswith('-') == backward
+        part = Q(**{f'{column}__{"gt" if ascending else "lt"}': values[i]})
+        for prev_name, prev_value in zip(order[:i], values[:i]):
+            part &= Q(**{prev_name.lstrip('-'): prev_value})
+        condition = part if condition is None else condition | part
+    return condition
+
+
+def keyset_values(instance: BaseModel, order: list[str]) -> list[Any]:
+    values = []
+    for name in order:
+        value = instance
+        for attr in name.lstrip('-').split('__'):
+            value = getattr(value, attr)
+        values.append(value)
+    return values
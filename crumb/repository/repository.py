@@ -1,17 +1,22 @@
+from copy import deepcopy
 from enum import Enum
 from typing import TypeVar, Literal, Any, Optional, Coroutine, Callable, overload, cast, Type
 
-from tortoise import fields
+from tortoise import fields, Model
+from tortoise.signals import Signals
 from tortoise.queryset import QuerySet
 from tortoise.transactions import in_transaction
 from tortoise.exceptions import ValidationError
 
 from crumb.orm.base_model import BaseModel
+from crumb.orm.bulk import insert_returning_pk
 from crumb.types import MODEL, PK, DATA, SortedData, BackFKData, ValuesListData
-from crumb.constants import EMPTY_TUPLE
+from crumb.constants import EMPTY_TUPLE, UndefinedValue
+from crumb.enums import FieldTypes, SaveReturning
 from crumb.exceptions import ObjectErrors, UnexpectedDataKey, FieldError, NotUnique, \
     FieldRequired, NotFoundFK, RequiredMissed, InvalidType, AnyFieldError, ListFieldError
 from .base import ReadRepository
+from .validation_cache import ValidationCache
 from .values_list_repository import ValuesListRepository
 
 
@@ -21,6 +26,11 @@ T = TypeVar('T')
 class Repository(ReadRepository[MODEL]):
 
     READ_ONLY_REPOSITORY = False
+    # Создавать записи back_fk одним запросом, если это не меняет поведение (см. can_bulk_create).
+    # False возвращает создание по одной записи через create
+    BULK_CREATE = True
+    # Заполняется на время validate корневым репозиторием и передается вложенным, см. child_repository
+    validation_cache: Optional[ValidationCache] = None
 
     def __init__(
             self,
@@ -37,6 +47,10 @@ class Repository(ReadRepository[MODEL]):
         )
         self.by = by
         self.instance = instance
+        # Поля модели, которые handle_edit должен сохранить помимо отличающихся от loaded_values
+        self.changed_fields: set[str] = set()
+        # Значения полей self.instance в начале edit, с ними handle_edit сравнивает экземпляр перед сохранением
+        self.loaded_values: Optional[dict[str, Any]] = None
 
     async def handle_create(
             self,
@@ -82,7 +96,8 @@ class Repository(ReadRepository[MODEL]):
             is_root: bool = True,
             run_in_transaction: Optional[bool] = None,
             validate: Optional[bool] = None,
-    ) -> MODEL:
+            returning: SaveReturning = SaveReturning.FULL,
+    ) -> MODEL | PK:
         """
         :param data: Данные для вставки в БД, которые соответствуют её структуре.
                      После передачи в функцию данные никак не изменяются.
@@ -95,6 +110,9 @@ class Repository(ReadRepository[MODEL]):
         :param validate: По умолчанию равно параметру is_root.
                          Стоит вручную передавать False, если передаются валидированные данные. Автоматически False
                          передается вместе с is_root, когда Repository.create вызывается из другой функции.
+        :param returning: FULL - запись перечитывается через get_one, если функция сама открыла транзакцию.
+                          INSTANCE - запись из памяти, к ней подвязаны созданные o2o, fk, back_o2o и back_fk.
+                          PK - только первичный ключ. INSTANCE и PK не делают лишний SELECT после сохранения.
         """
         self.raise_if_method_unavailable('create')
 
@@ -129,8 +147,9 @@ class Repository(ReadRepository[MODEL]):
 
             for field_name, value in sorted_data.back_o2o.items():
                 relation_field = self.get_field_instance(field_name).relation_source_field  # type: ignore
-                await self.repository_of(field_name)(by=relation_field)\
+                rel_instance = await self.repository_of(field_name)(by=relation_field)\
                     .create(value, defaults={relation_field: instance.pk}, is_root=False)
+                self.attach_back_o2o(instance, field_name, rel_instance)
 
             for field_name, bfk_data in sorted_data.back_fk.items():
                 relation_field = self.get_field_instance(field_name).relation_source_field  # type: ignore
@@ -140,26 +159,122 @@ class Repository(ReadRepository[MODEL]):
                         await remote_repository_cls(owner_instance=instance).create_list(bfk_data)
                     continue
                 remote_repository_cls = cast(Type[Repository], remote_repository_cls)
-                for value in bfk_data:
-                    await remote_repository_cls(by=relation_field)\
+                if remote_repository_cls.can_bulk_create(bfk_data):
+                    rel_instances = await remote_repository_cls(by=relation_field)\
+                        .bulk_create(bfk_data, defaults={relation_field: instance.pk})
+                else:
+                    rel_instances = [
+                        await remote_repository_cls(by=relation_field)
                         .create(value, defaults={relation_field: instance.pk}, is_root=False)
+                        for value in bfk_data
+                    ]
+                self.attach_back_fk(instance, field_name, rel_instances)
 
             self.instance = instance
             return instance
 
         if run_in_transaction:
             async with in_transaction():
-                return await self.get_one((await get_new_instance()).pk)
+                instance = await get_new_instance()
+                if returning == SaveReturning.FULL:
+                    instance = await self.get_one(instance.pk)
         else:
-            return await get_new_instance()
+            instance = await get_new_instance()
+        return instance.pk if returning == SaveReturning.PK else instance
+
+    @staticmethod
+    def attach_back_o2o(instance: MODEL, field_name: str, rel_instance: Optional[BaseModel]):
+        """Подвязывает записанный back_o2o, чтобы он был доступен без запроса в БД"""
+        setattr(instance, f'_{field_name}', rel_instance)
+
+    @staticmethod
+    def attach_back_fk(instance: MODEL, field_name: str, rel_instances: list[BaseModel]):
+        """Подвязывает записанные back_fk, как это делает fetch_related"""
+        getattr(instance, field_name)._set_result_for_query(rel_instances)
+
+    @classmethod
+    def can_bulk_create(cls, values: list[DATA]) -> bool:
+        """
+        Можно ли создать записи одним запросом без потери поведения create: у репозитория не переопределены
+        create, handle_create и get_create_defaults, у модели нет своего save и сигналов сохранения,
+        а в данных только поля самой таблицы
+        """
+        if not cls.BULK_CREATE or len(values) < 2:
+            return False
+        for name in ('create', 'handle_create', 'get_create_defaults'):
+            if getattr(cls, name) is not getattr(Repository, name):
+                return False
+        if cls.model_save_hooked():
+            return False
+        plain_types = (*FieldTypes.db_field_types(), FieldTypes.FK_PK, FieldTypes.O2O_PK)
+        _all_fields = cls.describe().all
+        return all(
+            _all_fields.get(key) in plain_types
+            for value in values
+            for key in value
+        )
+
+    async def bulk_create(self, values: list[DATA], defaults: Optional[DATA] = None) -> list[MODEL]:
+        """
+        Создает записи без вложенных данных одним INSERT (пачками), данные должны быть уже провалидированы.
+        Вызывается вместо create для back_fk, когда это разрешает can_bulk_create.
+        """
+        self.raise_if_method_unavailable('create')
+        instances = [
+            self.model(**{**(defaults or {}), **value})
+            for value in values
+        ]
+        await insert_returning_pk(self.model, instances)
+        return instances
 
     async def handle_edit(
             self,
             data: DATA,
             extra_data: DATA
     ):
+        """
+        Сохраняет только поля, которые отличаются от loaded_values (в том числе измененные переопределением
+        напрямую в self.instance до вызова super().handle_edit), и changed_fields. Если изменений нет, save
+        не вызывается. Без loaded_values или если у модели свой save или pre_save сигналы, которые могут
+        менять другие поля, сохраняется вся запись
+        """
         self.instance.update_from_dict(data)
-        await self.instance.save(force_update=True)
+        if self.loaded_values is None or self.model_save_hooked():
+            await self.instance.save(force_update=True)
+            return
+        changed_fields = self.changed_fields | self.get_changed_fields(self.loaded_values)
+        if changed_fields:
+            await self.instance.save(force_update=True, update_fields=self.get_update_fields(changed_fields))
+
+    def get_loaded_values(self) -> dict[str, Any]:
+        """Значения колонок self.instance, копии - чтобы изменение JSON и т.п. на месте тоже было заметно"""
+        return {
+            name: deepcopy(getattr(self.instance, name))
+            for name in self.opts().fields_db_projection
+        }
+
+    def get_changed_fields(self, loaded_values: dict[str, Any]) -> set[str]:
+        """Колонки self.instance, значения которых отличаются от loaded_values"""
+        return {
+            name for name, value in loaded_values.items()
+            if getattr(self.instance, name) != value
+        }
+
+    @classmethod
+    def model_save_hooked(cls) -> bool:
+        """У модели свой save или сигналы сохранения, т.е. сохранение может делать больше, чем записать поля"""
+        return cls.model.save is not Model.save or any(
+            cls.model._listeners[signal].get(cls.model) for signal in (Signals.pre_save, Signals.post_save)
+        )
+
+    def get_update_fields(self, changed_fields: set[str]) -> list[str]:
+        """Поля для save(update_fields=...): измененные и auto_now, которые обновляются при каждом сохранении"""
+        opts = self.opts()
+        auto_now = [
+            name for name in opts.fields_db_projection
+            if isinstance(opts.fields_map[name], fields.DatetimeField) and opts.fields_map[name].auto_now
+        ]
+        return [*changed_fields, *(name for name in auto_now if name not in changed_fields)]
 
     async def edit(
             self,
@@ -169,7 +284,8 @@ class Repository(ReadRepository[MODEL]):
             is_root: bool = True,
             run_in_transaction: Optional[bool] = None,
             validate: Optional[bool] = None,
-    ) -> MODEL:
+            returning: SaveReturning = SaveReturning.FULL,
+    ) -> MODEL | PK:
         """
         :param data: Данные для вставки в БД, которые соответствуют её структуре.
                      После передачи в функцию данные никак не изменяются.
@@ -182,6 +298,9 @@ class Repository(ReadRepository[MODEL]):
         :param validate: По умолчанию равно параметру is_root.
                          Стоит вручную передавать False, если передаются валидированные данные. Автоматически False
                          передается вместе с is_root, когда Repository.create вызывается из другой функции.
+        :param returning: FULL - запись перечитывается через get_one, если функция сама открыла транзакцию.
+                          INSTANCE - запись из памяти, к ней подвязаны созданные o2o, fk, back_o2o и back_fk.
+                          PK - только первичный ключ. INSTANCE и PK не делают лишний SELECT после сохранения.
         """
         self.raise_if_method_unavailable('edit')
 
@@ -213,8 +332,11 @@ class Repository(ReadRepository[MODEL]):
                 for field_name, value in getattr(sorted_data, t).items():
                     direct_related[field_name] = value
 
+            edit_data = {**(defaults or {}), **sorted_data.db_field, **direct_related}
+            self.changed_fields = set()
+            self.loaded_values = self.get_loaded_values()
             await self.handle_edit(
-                data={**(defaults or {}), **sorted_data.db_field, **direct_related},
+                data=edit_data,
                 extra_data=sorted_data.extra
             )
 
@@ -227,9 +349,10 @@ class Repository(ReadRepository[MODEL]):
                         instance=rel_instance
                     ).edit(value, is_root=False)
                 else:
-                    await self.repository_of(field_name)(
+                    rel_instance = await self.repository_of(field_name)(
                         by=relation_field
                     ).create(value, defaults={relation_field: self.instance.pk}, is_root=False)
+                    self.attach_back_o2o(self.instance, field_name, rel_instance)
 
             for field_name, bfk_data in sorted_data.back_fk.items():
                 remote_repository_cls = self.repository_of(field_name)
@@ -240,6 +363,8 @@ class Repository(ReadRepository[MODEL]):
                 reverse_name = self.get_reverse_name(field_name)
                 relation_field = self.get_field_instance(field_name).relation_source_field  # type: ignore
                 rel_instances_map = await self.get_relational_list(field_name, in_map=True)
+                rel_instances = []
+                new_values = []
                 for value in bfk_data:
                     if 'pk' in value:
                         rel_instance = rel_instances_map.pop(value['pk'])
@@ -248,22 +373,33 @@ class Repository(ReadRepository[MODEL]):
                                 {k: v for k, v in value.items() if k != 'pk'},
                                 is_root=False
                             )
+                        rel_instances.append(rel_instance)
                     else:
-                        await remote_repository_cls(by=reverse_name).create(
+                        new_values.append(value)
+                if remote_repository_cls.can_bulk_create(new_values):
+                    rel_instances += await remote_repository_cls(by=reverse_name)\
+                        .bulk_create(new_values, defaults={relation_field: self.instance.pk})
+                else:
+                    for value in new_values:
+                        rel_instances.append(await remote_repository_cls(by=reverse_name).create(
                             value,
                             defaults={relation_field: self.instance.pk},
                             is_root=False
-                        )
+                        ))
                 if rel_instances_map:
                     await remote_repository_cls(by=reverse_name).delete_many([v.pk for v in rel_instances_map.values()])
+                self.attach_back_fk(self.instance, field_name, rel_instances)
 
             return self.instance
 
         if run_in_transaction:
             async with in_transaction():
-                return await self.get_one((await get_updated_instance()).pk)
+                instance = await get_updated_instance()
+                if returning == SaveReturning.FULL:
+                    instance = await self.get_one(instance.pk)
         else:
-            return await get_updated_instance()
+            instance = await get_updated_instance()
+        return instance.pk if returning == SaveReturning.PK else instance
 
     async def delete_many(self, item_pk_list: list[PK]) -> int:
         self.raise_if_method_unavailable('delete_many')
@@ -288,7 +424,11 @@ class Repository(ReadRepository[MODEL]):
             related_field = cast(fields.relational.ForeignKeyFieldInstance, field.reference)
         else:
             raise Exception(f'{self.model}.{field_name} не относится к o2o, o2o_pk, fk, fk_pk, back_o2o, back_fk')
-        related_instance = await related_field.related_model.get_or_none(pk=item_pk)
+        related_instance = UndefinedValue
+        if self.validation_cache is not None:
+            related_instance = self.validation_cache.get_fk(related_field.related_model, item_pk)
+        if related_instance is UndefinedValue:
+            related_instance = await related_field.related_model.get_or_none(pk=item_pk)
         if related_instance is None:
             raise NotFoundFK
         return related_instance
@@ -301,7 +441,14 @@ class Repository(ReadRepository[MODEL]):
     ) -> None:
         if self.instance and getattr(self.instance, field_name) == value:
             return
-        if await self.model.exists(**{field_name: value}):
+        is_unique = UndefinedValue
+        if self.validation_cache is not None:
+            is_unique = self.validation_cache.is_unique(
+                self.model, field_name, value, self.instance.pk if self.instance else None
+            )
+        if is_unique is UndefinedValue:
+            is_unique = not await self.model.exists(**{field_name: value})
+        if not is_unique:
             raise NotUnique
 
     async def check_unique_together(
@@ -343,7 +490,55 @@ class Repository(ReadRepository[MODEL]):
                 sorted_data.db_field[key] = value
         return sorted_data
 
+    @classmethod
+    def collect_validation_data(cls, data: DATA, cache: ValidationCache) -> None:
+        """
+        Собирает в cache значения из data и вложенных данных, которые валидация проверяет в БД.
+        Некорректные данные пропускаются, ошибки по ним вернет сама валидация.
+        """
+        if not isinstance(data, dict):
+            return
+        _all_fields = cls.describe().all
+        for key, value in data.items():
+            field_type = _all_fields.get(key)
+            if field_type in (FieldTypes.O2O_PK, FieldTypes.FK_PK):
+                field = cls.get_field_instance(key)
+                if value is not None and isinstance(value, field.field_type):
+                    cache.add_fk(field.reference.related_model, value)
+                    if field_type == FieldTypes.O2O_PK:
+                        cache.add_unique(cls.model, key, value)
+            elif field_type is not None and field_type.is_db_field():
+                field = cls.get_field_instance(key)
+                if field.unique and value is not None and isinstance(value, field.field_type):
+                    cache.add_unique(cls.model, key, value)
+            elif field_type in (FieldTypes.O2O, FieldTypes.FK, FieldTypes.BACK_O2O):
+                remote_repository_cls = cls.repository_of(key)
+                if issubclass(remote_repository_cls, Repository):
+                    remote_repository_cls.collect_validation_data(value, cache)
+            elif field_type == FieldTypes.BACK_FK and isinstance(value, list):
+                remote_repository_cls = cls.repository_of(key)
+                if issubclass(remote_repository_cls, Repository):
+                    for val in value:
+                        remote_repository_cls.collect_validation_data(val, cache)
+
+    def child_repository(self, repository_cls: Type["Repository"], **kwargs) -> "Repository":
+        """Репозиторий вложенных данных, который проверяет их по validation_cache этого репозитория"""
+        repository = repository_cls(**kwargs)
+        repository.validation_cache = self.validation_cache
+        return repository
+
     async def validate(self, data: DATA) -> None:
+        if self.validation_cache is not None:
+            return await self.validate_data(data)
+        self.validation_cache = ValidationCache()
+        try:
+            self.collect_validation_data(data, self.validation_cache)
+            await self.validation_cache.load()
+            await self.validate_data(data)
+        finally:
+            self.validation_cache = None
+
+    async def validate_data(self, data: DATA) -> None:
         errors = ObjectErrors()
 
         required, pairs = self.required_and_pairs()
@@ -423,7 +618,8 @@ class Repository(ReadRepository[MODEL]):
             value: DATA,
             data: DATA,
     ):
-        await self.repository_of(field_name)(
+        await self.child_repository(
+            self.repository_of(field_name),
             by=self.get_reverse_name(field_name),
             instance=await self.get_relational(field_name) if self.instance else None
         ).validate(value)
@@ -540,7 +736,8 @@ class Repository(ReadRepository[MODEL]):
                     continue
                 val = {k: v for k, v in val.items() if k != 'pk'}
             try:
-                await remote_repository_cls(
+                await self.child_repository(
+                    remote_repository_cls,
                     by=reverse_name,
                     instance=rel_instance
                 ).validate(val)
@@ -0,0 +1,81 @@
+from functools import reduce
+from operator import or_
+from typing import Type, Any
+
+from tortoise.queryset import Q
+
+from crumb.constants import UndefinedValue
+from crumb.orm import BaseModel
+from crumb.types import PK
+
+
+__all__ = ["ValidationCache"]
+
+
+class ValidationCache:
+    """
+    Значения, которые валидация проверяет в БД, собранные заранее по всему вложенному payload.
+    Проверяются одним запросом на модель вместо запроса на каждое поле каждого вложенного объекта.
+    """
+
+    def __init__(self):
+        self.fk_pks: dict[Type[BaseModel], set[PK]] = {}
+        self.fk_instances: dict[Type[BaseModel], dict[PK, BaseModel]] = {}
+        self.fk_checked: dict[Type[BaseModel], set[PK]] = {}
+        # {модель: {поле: {значение: сколько раз встретилось в payload}}}
+        self.unique_values: dict[Type[BaseModel], dict[str, dict[Any, int]]] = {}
+        # {модель: {поле: {значение: pk записей в БД с этим значением}}}
+        self.unique_pks: dict[Type[BaseModel], dict[str, dict[Any, set[PK]]]] = {}
+
+    def add_fk(self, model: Type[BaseModel], pk: PK):
+        if pk not in self.fk_checked.get(model, ()):
+            self.fk_pks.setdefault(model, set()).add(pk)
+
+    def add_unique(self, model: Type[BaseModel], field_name: str, value: Any):
+        values = self.unique_values.setdefault(model, {}).setdefault(field_name, {})
+        values[value] = values.get(value, 0) + 1
+
+    async def load(self):
+        for model, pks in self.fk_pks.items():
+            instances = self.fk_instances.setdefault(model, {})
+            for instance in await model.filter(pk__in=list(pks)):
+                instances[instance.pk] = instance
+            self.fk_checked.setdefault(model, set()).update(pks)
+        self.fk_pks = {}
+
+        for model, fields_values in self.unique_values.items():
+            if model in self.unique_pks:
+                continue
+            found = self.unique_pks[model] = {field_name: {} for field_name in fields_values}
+            field_names = list(fields_values)
+            query = model.filter(reduce(or_, (
+                Q(**{f'{field_name}__in': list(fields_values[field_name])}) for field_name in field_names
+            )))
+            for pk, *values in await query.values_list(model._meta.pk_attr, *field_names):
+                for field_name, value in zip(field_names, values):
+                    if value in fields_values[field_name]:
+                        found[field_name].setdefault(value, set()).add(pk)
+
+    def get_fk(self, model: Type[BaseModel], pk: PK) -> BaseModel | None | Type[UndefinedValue]:
+        """Найденная запись, None, если ее нет, или UndefinedValue, если pk не проверялся"""
+        if pk not in self.fk_checked.get(model, ()):
+            return UndefinedValue
+        return self.fk_instances[model].get(pk)
+
+    def is_unique(
+            self,
+            model: Type[BaseModel],
+            field_name: str,
+            value: Any,
+            pk: PK = None,
+    ) -> bool | Type[UndefinedValue]:
+        """
+        Уникально ли значение: его нет в БД у других записей (кроме pk) и оно один раз встречается в payload.
+        UndefinedValue, если значение не проверялось.
+        """
+        count = self.unique_values.get(model, {}).get(field_name, {}).get(value)
+        if count is None or field_name not in self.unique_pks.get(model, {}):
+            return UndefinedValue
+        if count > 1:
+            return False
+        return not (self.unique_pks[model][field_name].get(value, set()) - {pk})
@@ -7,8 +7,9 @@ from tortoise.functions import Max
 
 from .base import BaseRepository
 from ..constants import UndefinedValue
-from ..enums import FieldTypes
+from ..enums import FieldTypes, BulkInsertMethod
 from ..orm import BaseModel
+from ..orm.bulk import bulk_insert
 from ..types import LIST_VALUE_MODEL, MODEL, RepositoryDescription, ValuesListData, PK, DATA
 from ..exceptions import ListFieldError, UnexpectedDataKey, AnyFieldError, InvalidType, FieldRequired, FieldError, \
     ObjectErrors, NotFoundFK
@@ -20,6 +21,8 @@ if TYPE_CHECKING:
 class ValuesListRepository(BaseRepository[LIST_VALUE_MODEL], Generic[LIST_VALUE_MODEL, MODEL]):
 
     hidden_fields = {'id', 'owner', 'owner_id'}
+    # Как вставлять строки. COPY работает только с asyncpg, иначе используется INSERT
+    insert_method: BulkInsertMethod = BulkInsertMethod.INSERT
 
     def __init__(self, owner_instance: Optional[MODEL] = None):
         self.owner_instance = owner_instance
@@ -43,7 +46,7 @@ class ValuesListRepository(BaseRepository[LIST_VALUE_MODEL], Generic[LIST_VALUE_
             record = self.model(owner=self.owner_instance, **record_data)
             record.set_pk()
             records.append(record)
-        await self.model.bulk_create(records, batch_size=100)
+        await bulk_insert(self.model, records, method=self.insert_method)
 
     async def add(self, data: ValuesListData):
         assert self.owner_instance
@@ -1,5 +1,6 @@
 from dataclasses import dataclass, field
-from typing import TypeVar, Any, TypedDict
+from types import SimpleNamespace
+from typing import TypeVar, Any, TypedDict, Generic, Optional
 from uuid import UUID
 
 from tortoise import fields
@@ -47,3 +48,29 @@ class RepositoryDescription:
     back_o2o: dict[str, fields.relational.BackwardOneToOneRelation] = field(default_factory=dict)
     back_fk: dict[str, fields.relational.BackwardFKRelation] = field(default_factory=dict)
     hidden: dict[str, fields.Field] = field(default_factory=dict)
+
+
+@dataclass
+class Page(Generic[MODEL]):
+    """Страница keyset-пагинации. Курсоры передаются в ReadRepository.get_page, None - страницы нет"""
+    items: list[MODEL]
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+
+
+class Total(int):
+    """Общее количество записей. estimated - приблизительная оценка, а не точный подсчет"""
+    estimated: bool
+
+    def __new__(cls, value: int, estimated: bool = False):
+        total = super().__new__(cls, value)
+        total.estimated = estimated
+        return total
+
+
+class ProjectionRow(SimpleNamespace):
+    """
+    Легкая строка из ReadRepository.get_all(projection=...) вместо экземпляра модели:
+    только запрошенные колонки, pk и подгруженные o2o/fk
+    """
+    pk: Any
@@ -1,6 +1,8 @@
 import importlib
 import re
-from typing import Any, TypeVar, TYPE_CHECKING, Type
+from enum import Enum
+from hashlib import blake2b
+from typing import Any, TypeVar, TYPE_CHECKING, Type, Iterable
 
 if TYPE_CHECKING:
     from crumb.users.repository import BaseUserRepository
@@ -23,6 +25,35 @@ def default_if_none(value: T, default: Any) -> T:
     return value
 
 
+def hash_key(values: Iterable[Any]) -> int:
+    """
+    Стабильный между процессами 64-битный хэш набора значений, помещается в BigIntField.
+    Каждое значение кодируется с типом и длиной, поэтому None и 'None', 1 и '1', (1, 2) и ('1', '2') различаются.
+    Хэш - id итогов регистров: если кодирование меняется, итоги нужно перестроить (rebuild_results)
+    """
+    encoded = ''.join(_encode_key_part(value) for value in values)
+    digest = blake2b(encoded.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+def _encode_key_part(value: Any) -> str:
+    if isinstance(value, Enum):
+        value = value.value
+    if value is None:
+        tag, text = 'n', ''
+    elif isinstance(value, bool):
+        tag, text = 'b', str(int(value))
+    elif isinstance(value, int):
+        tag, text = 'i', str(value)
+    elif isinstance(value, float):
+        tag, text = 'f', repr(value)
+    elif isinstance(value, str):
+        tag, text = 's', value
+    else:
+        tag, text = type(value).__name__, str(value)
+    return f'{tag}{len(text)}:{text}'
+
+
 def import_string(dotted_path: str) -> Any:
     """
     Stolen approximately from django. Import a dotted module path and return the attribute/class designated by the